@@ -0,0 +1,113 @@
+import asyncio
+import time
+import timeit
+from collections.abc import Awaitable, Callable
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+from sqlalchemy import event
+
+from src.bot.schemas import GoodSchema
+from src.bot.service import Service
+from src.db.db_conf import build_session_router, close_orm, engine, init_orm
+from src.db.models import DeliveryTypes
+from src.db.repository import Repository, ShopRepository
+from src.settings import Settings
+
+GOODS_COUNT = 1000
+REPEAT = 50
+
+
+class LegacyGoodSchema(BaseModel):
+    id: int
+    name: str
+    description: str
+    price: Decimal
+    photo_file_path: str | None
+
+
+def _report(name: str, seconds: float) -> None:
+    per_good = seconds / (REPEAT * GOODS_COUNT) * 1e6
+    print(f"{name:<40}{seconds * 1000 / REPEAT:>10.3f} ms/catalog{per_good:>10.3f} us/good")
+
+
+def bench_read_models() -> None:
+    # Photo columns added after photo_file_path are left empty, as for goods without processed photos
+    empty_photo_columns = (None,) * (len(GoodSchema._fields) - len(LegacyGoodSchema.model_fields))
+    rows = [
+        (i, f"good {i}", "description", Decimal("199.99"), "data/photos/espresso.jpg") + empty_photo_columns
+        for i in range(GOODS_COUNT)
+    ]
+    objects = [SimpleNamespace(**GoodSchema._make(row)._asdict()) for row in rows]
+
+    before = timeit.timeit(
+        lambda: [LegacyGoodSchema.model_validate(obj, from_attributes=True) for obj in objects],
+        number=REPEAT,
+    )
+    after = timeit.timeit(lambda: [GoodSchema._make(row) for row in rows], number=REPEAT)
+    _report("pydantic model_validate(from_attributes)", before)
+    _report("NamedTuple._make(row)", after)
+    print(f"speedup: x{before / after:.1f}")
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args: object) -> None:
+        self.count += 1
+
+
+async def _measure(
+    counter: QueryCounter, name: str, operation: Callable[[], Awaitable[object]], repeat: int = 100
+) -> None:
+    counter.count = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await operation()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<40}{elapsed * 1000 / repeat:>10.3f} ms/op{counter.count / repeat:>10.1f} queries/op")
+
+
+async def bench_queries() -> None:
+    # Run against a disposable database, e.g. DATABASE_URL=sqlite+aiosqlite:///bench.db
+    await init_orm()
+    try:
+        await _bench_queries()
+    finally:
+        await close_orm()  # aiosqlite keeps the process alive until the engine is disposed
+
+
+async def _bench_queries() -> None:
+    router = build_session_router()
+    shop_id = await ShopRepository(router).get_or_create_shop_id(Settings.DEFAULT_SHOP_NAME)
+    repository = Repository(router, shop_id)
+    service = Service(repository)
+    counter = QueryCounter()
+    chat_id = -1  # never a real private chat id
+    try:
+        await service.check_user_existance(chat_id)
+    except Exception:
+        await service.create_cart_user(chat_id)
+        await service.add_user_contacts(chat_id, "Bench,+70000000000,Bench")
+    catalog = await service.get_validated_categories_goods()
+    good_id = next((good.id for category in catalog for good in category.goods), None)
+    if good_id is None:
+        print("No goods in the catalog, load data first with `python -m src.scripts`")
+        return
+
+    await _measure(counter, "repository.get_all_categories_goods", repository.get_all_categories_goods)
+    await _measure(counter, "service.get_validated_categories_goods", service.get_validated_categories_goods)
+    await _measure(counter, "service.add_good_in_cart", lambda: service.add_good_in_cart(chat_id, good_id))
+    await _measure(counter, "service.get_goods_from_cart", lambda: service.get_goods_from_cart(chat_id))
+    await _measure(counter, "service.display_total_cost", lambda: service.display_total_cost(chat_id))
+    await _measure(
+        counter, "service.create_order", lambda: service.create_order(chat_id, DeliveryTypes.PICKUP), repeat=10
+    )
+
+
+if __name__ == "__main__":
+    bench_read_models()
+    asyncio.run(bench_queries())
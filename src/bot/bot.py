@@ -1,14 +1,17 @@
+import asyncio
 import logging
 from enum import Enum
-from pathlib import Path
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
     BotCommand,
     FSInputFile,
+    InlineKeyboardMarkup,
+    InlineQuery,
     KeyboardButton,
     Message,
     ReplyKeyboardMarkup,
@@ -16,9 +19,28 @@ from aiogram.types import (
 from aiogram.types.callback_query import CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from src.bot.callbacks import (
+    AddGoodCallback,
+    CategoryCallback,
+    DeleteGoodCallback,
+    OrdersPageCallback,
+    QuantityCallback,
+)
 from src.bot.exceptions import UserDoesNotExist, WrongContactsInput
+from src.bot.inline import InlineCatalog
+from src.bot.middlewares import (
+    ChatContextMiddleware,
+    InFlightMiddleware,
+    TracingMiddleware,
+    TracingRequestMiddleware,
+)
+from src.bot.render import RenderCache, RenderedView, ViewKind
+from src.bot.schemas import CartGoodSchema, GoodSchema
 from src.bot.service import Service
 from src.db.models import DeliveryTypes
+from src.images import ImageProcessor
+from src.settings import Settings
+from src.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +49,9 @@ class TextConstants(Enum):
     GREETINGS = "Добро пожаловать в наш магазин!"
     CATEGORIES = "Категории товаров"
     CART = "Корзина"
+    MY_ORDERS = "Мои заказы"
+    NO_USER_ORDERS = "У вас пока нет заказов"
+    MORE_ORDERS = "Показать ещё"
     GOODS = "Товары"
     ADD_TO_CART = "Добавить в корзину"
     GOOD_ADDED = "Товар успешно добавлен в корзину"
@@ -56,8 +81,14 @@ class TextConstants(Enum):
     )
     STATUS_INPUT_FORMAT = "<id заказа>,<новый статус>"
     NO_ORDERS = "Заказов не найдено"
+    NO_SALES = "Продаж за период не найдено"
     INPUT_HINT = "Введите после команды текст в строго следующем формате:\n"
     UPDATE_INPUT_HINT = "\nПервые три поля оптицональны"
+    PHOTO_INPUT_FORMAT = "<название товара>"
+    PHOTO_REQUEST = "Отправьте фото товара"
+    INCORRECT_INPUT = "Неверный формат ввода"
+    GOOD_UNAVAILABLE = "Товар больше недоступен"
+    CATEGORY_UNAVAILABLE = "Категория больше недоступна, список категорий обновлён"
 
 
 class BotCmds(Enum):
@@ -69,6 +100,8 @@ class BotCmds(Enum):
     CHANGE_ORDER_STATUS = "change_status"
     ADD_GOOD = "add_good"
     EDIT_GOOD = "edit_good"
+    SET_PHOTO = "set_photo"
+    STATS = "stats"
 
 
 DELIVERY_TYPES_MAP = {
@@ -93,27 +126,75 @@ class AdminTokenRequest(StatesGroup):
     waiting_for_token = State()
 
 
+class PhotoUpload(StatesGroup):
+    waiting_for_photo = State()
+
+
 class ShopBot:
-    def __init__(self, dp: Dispatcher, bot_obj: Bot, service: Service, admin_token: str) -> None:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot_obj: Bot,
+        service: Service,
+        inline_catalog: InlineCatalog,
+        render_cache: RenderCache,
+        image_processor: ImageProcessor,
+        admin_token: str,
+    ) -> None:
         self._dp = dp
         self._bot = bot_obj
         self._service = service
+        self._inline_catalog = inline_catalog
+        self._render_cache = render_cache
+        self._image_processor = image_processor
         self._admin_token = admin_token
-        
+        self._in_flight = InFlightMiddleware()
+
+    def setup(self) -> None:
+        if tracer.enabled:
+            self._dp.update.outer_middleware(TracingMiddleware())
+            self._bot.session.middleware(TracingRequestMiddleware())
+        self._dp.update.outer_middleware(ChatContextMiddleware())
+        self._dp.update.outer_middleware(self._in_flight)
+        self._register_handlers()
+
     async def start(self) -> None:
-        await self._set_commands()
+        # Several shops can share the process, so signals and the bot session are handled by the caller
+        await self._dp.start_polling(self._bot, handle_signals=False, close_bot_session=False)
+
+    async def stop(self) -> None:
+        try:
+            await self._dp.stop_polling()
+        except RuntimeError:  # polling already finished
+            pass
+
+    async def close(self) -> None:
+        await self._bot.session.close()
+
+    async def drain(self, timeout: float) -> None:
+        logger.info(f"Draining {self._in_flight.in_flight} in-flight updates")
+        if not await self._in_flight.wait_idle(timeout):
+            logger.warning(f"{self._in_flight.in_flight} updates still in flight after {timeout}s")
+
+    def _register_handlers(self) -> None:
         self._start_cmd_handler()
         self._help_cmd_handler()
         self._admin_cmd_handler()
         self._show_admin_cmds()
         self._handle_show_orders_cmd()
+        self._handle_stats_cmd()
         self._handle_change_status_cmd()
         self._handle_add_good_cmd()
         self._handle_edit_good_cmd()
+        self._handle_set_photo_cmd()
+        self._handle_good_photo()
         self._handle_category()
         self._handle_categories_goods()
         self._handle_add_in_cart()
+        self._handle_inline_query()
         self._handle_cart()
+        self._handle_my_orders()
+        self._handle_orders_page()
         self._handle_cart_goods()
         self._handle_delete_good_from_cart()
         self._handle_request_quantity()
@@ -122,15 +203,15 @@ class ShopBot:
         self._handle_add_contacts()
         self._handle_order_approvement_request()
         self._handle_order_approvement()
-        await self._dp.start_polling(self._bot)
 
-    async def _set_commands(self) -> None:
+    @staticmethod
+    async def set_commands(bot_obj: Bot) -> None:
         commands = [
             BotCommand(command=BotCmds.START.value, description="Start bot"),
             BotCommand(command=BotCmds.HELP.value, description="Help"),
             BotCommand(command=BotCmds.ADMIN.value, description="Show admin commans"),
         ]
-        await self._bot.set_my_commands(commands)
+        await bot_obj.set_my_commands(commands)
 
     def _start_cmd_handler(self) -> None:
         @self._dp.message(CommandStart())
@@ -161,7 +242,8 @@ class ShopBot:
             await msg.answer(
                 text=(
                     f"Доступные команды:\n/{BotCmds.SHOW_ORDERS.value}\n/{BotCmds.CHANGE_ORDER_STATUS.value}\n"
-                    f"/{BotCmds.ADD_GOOD.value}\n/{BotCmds.EDIT_GOOD.value}"
+                    f"/{BotCmds.ADD_GOOD.value}\n/{BotCmds.EDIT_GOOD.value}\n/{BotCmds.SET_PHOTO.value}"
+                    f"\n/{BotCmds.STATS.value}"
                 )
             )
 
@@ -173,6 +255,14 @@ class ShopBot:
                 text = TextConstants.NO_ORDERS.value
             await msg.answer(text=text)
 
+    def _handle_stats_cmd(self) -> None:
+        @self._dp.message(Command(BotCmds.STATS.value))
+        async def handle(msg: Message, command: CommandObject) -> None:
+            text = await self._service.show_stats(command.args)
+            if not text:
+                text = TextConstants.NO_SALES.value
+            await msg.answer(text=text)
+
     def _handle_change_status_cmd(self) -> None:
         @self._dp.message(Command(BotCmds.CHANGE_ORDER_STATUS.value))
         async def hangle(msg: Message, command: CommandObject) -> None:
@@ -203,6 +293,38 @@ class ShopBot:
                 text = await self._service.update_good(command.args)
             await msg.answer(text=text)
 
+    def _handle_set_photo_cmd(self) -> None:
+        @self._dp.message(Command(BotCmds.SET_PHOTO.value))
+        async def handle(msg: Message, command: CommandObject, state: FSMContext) -> None:
+            if not command.args:
+                await msg.answer(text=f"{TextConstants.INPUT_HINT.value}{TextConstants.PHOTO_INPUT_FORMAT.value}")
+                return
+            await state.update_data(good_name=command.args.strip())
+            await state.set_state(PhotoUpload.waiting_for_photo)
+            await msg.answer(text=TextConstants.PHOTO_REQUEST.value)
+
+    def _handle_good_photo(self) -> None:
+        @self._dp.message(PhotoUpload.waiting_for_photo, F.photo)
+        async def handle(msg: Message, state: FSMContext) -> None:
+            # The state is cleared even on failure, otherwise every later photo of the admin lands here
+            try:
+                data = await state.get_data()
+                # Checked first, so that photos of unknown goods are not processed and stored
+                if await self._service.get_good_id_by_name(data["good_name"]) is None:
+                    text = TextConstants.INCORRECT_INPUT.value
+                else:
+                    file_id = msg.photo[-1].file_id
+                    source = await self._bot.download(file_id)
+                    processed = await self._image_processor.process(source.getvalue())
+                    text = await self._service.set_good_photo(data["good_name"], file_id, processed)
+                    self._inline_catalog.invalidate()
+            except Exception as e:
+                logger.error(f"Photo not saved: {e}")
+                text = TextConstants.INCORRECT_INPUT.value
+            finally:
+                await state.clear()
+            await msg.answer(text=text)
+
     def _build_main_keyboard(self) -> None:
         keyboard = ReplyKeyboardMarkup(
             keyboard=[
@@ -210,6 +332,7 @@ class ShopBot:
                     KeyboardButton(text=TextConstants.CATEGORIES.value),
                     KeyboardButton(text=TextConstants.CART.value),
                 ],
+                [KeyboardButton(text=TextConstants.MY_ORDERS.value)],
             ],
             resize_keyboard=True,
         )
@@ -218,58 +341,114 @@ class ShopBot:
     def _handle_category(self) -> None:
         @self._dp.message(F.text == TextConstants.CATEGORIES.value)
         async def handle(msg: Message) -> None:
-            categories_schemas = await self._service.get_validated_categories_goods()
-            builder = InlineKeyboardBuilder()
-            for i, category_schema in enumerate(categories_schemas):
-                builder.button(text=category_schema.name, callback_data=f"Category:{i}")
-            builder.adjust(1)
+            markup = await self._build_categories_markup()
             await msg.answer(
                 f"{TextConstants.CATEGORIES.value}:",
-                reply_markup=builder.as_markup(),
+                reply_markup=markup,
+            )
+
+    async def _build_categories_markup(self) -> InlineKeyboardMarkup:
+        categories_schemas = await self._service.get_validated_categories_goods()
+        builder = InlineKeyboardBuilder()
+        for category_schema in categories_schemas:
+            builder.button(
+                text=category_schema.name,
+                callback_data=CategoryCallback(category_id=category_schema.id),
             )
+        builder.adjust(1)
+        return builder.as_markup()
+
+    def _build_good_markup(self, good_id: int) -> InlineKeyboardMarkup:
+        builder = InlineKeyboardBuilder()
+        builder.button(
+            text=TextConstants.ADD_TO_CART.value,
+            callback_data=AddGoodCallback(good_id=good_id, version=self._service.catalog_version),
+        )
+        return builder.as_markup()
 
     def _handle_categories_goods(self) -> None:
-        @self._dp.callback_query(F.data.startswith("Category:"))
-        async def handler(callback: CallbackQuery) -> None:
-            categories_schemas = await self._service.get_validated_categories_goods()
-            ind_x = int(callback.data.split(":")[1])
-            for i, good_schema in enumerate(categories_schemas[ind_x].goods):
-                good_data = self._service.display_good_base(good_schema)
-                text, relative_path = (
-                    good_data["text"],
-                    good_data["photo_path"],
-                )
-                builder = InlineKeyboardBuilder()
-                builder.button(
-                    text=TextConstants.ADD_TO_CART.value,
-                    callback_data=f"AddGood:{i}:{ind_x}",
-                )
-                if relative_path:
-                    BASE_DIR = Path(__file__).parent.parent.parent  # Be carefull if reorgonised project
-                    photo_path = BASE_DIR / relative_path
-                    if photo_path.exists():
+        @self._dp.callback_query(CategoryCallback.filter())
+        async def handler(callback: CallbackQuery, callback_data: CategoryCallback) -> None:
+            category_schema = await self._service.get_category(callback_data.category_id)
+            if not category_schema:
+                markup = await self._build_categories_markup()
+                await callback.message.edit_reply_markup(reply_markup=markup)
+                await callback.answer(text=TextConstants.CATEGORY_UNAVAILABLE.value)
+                return
+            for good_schema in category_schema.goods:
+                view = self._render_good(good_schema)
+                relative_path = good_schema.photo_processed_path or good_schema.photo_file_path
+                file_id = self._service.get_photo_file_id(good_schema.id)
+                if file_id:
+                    await callback.message.answer_photo(file_id)
+                elif relative_path:
+                    # Local files are only a fallback: once uploaded, the returned file_id is persisted
+                    photo_path = Settings.BASE_DIR / relative_path
+                    if await asyncio.to_thread(photo_path.exists):
                         photo = FSInputFile(photo_path)
-                        await callback.message.answer_photo(photo)
-                await callback.message.answer(text, reply_markup=builder.as_markup())
+                        sent = await callback.message.answer_photo(photo)
+                        await self._service.save_photo_file_id(good_schema.id, sent.photo[-1].file_id)
+                        self._inline_catalog.invalidate()
+                await callback.message.answer(view.text, reply_markup=view.markup)
             await callback.answer()
 
     def _handle_add_in_cart(self) -> None:
-        @self._dp.callback_query(F.data.startswith("AddGood:"))
-        async def handle(callback: CallbackQuery) -> None:
-            categories_schemas = await self._service.get_validated_categories_goods()
-            good_indx, category_indx = (
-                int(callback.data.split(":")[1]),
-                int(callback.data.split(":")[2]),
-            )
-            chat_id = callback.message.chat.id
-            good_id = categories_schemas[category_indx].goods[good_indx].id
+        @self._dp.callback_query(AddGoodCallback.filter())
+        async def handle(callback: CallbackQuery, callback_data: AddGoodCallback) -> None:
+            good_schema = await self._service.get_good(callback_data.good_id)
+            if not good_schema:
+                await callback.answer(text=TextConstants.GOOD_UNAVAILABLE.value, show_alert=True)
+                return
+            if callback_data.version != self._service.catalog_version:
+                await self._rerender_good(callback, good_schema)
+            chat_id = callback.from_user.id  # callbacks from inline messages have no message
             text = TextConstants.GOOD_ADDED.value
             try:
-                await self._service.add_good_in_cart(chat_id, good_id)
+                await self._service.add_good_in_cart(chat_id, good_schema.id)
             except UserDoesNotExist as e:
                 text = str(e)
-            await callback.message.answer(text=text)
-            await callback.answer()
+            if callback.message:
+                await callback.message.answer(text=text)
+                await callback.answer()
+            else:
+                await callback.answer(text=text, show_alert=True)
+
+    def _render_good(self, good_schema: GoodSchema) -> RenderedView:
+        return self._render_cache.get_or_render(
+            good_schema.id,
+            self._service.catalog_version,
+            ViewKind.GOOD,
+            lambda: RenderedView(
+                text=self._service.display_good_base(good_schema)["text"],
+                markup=self._build_good_markup(good_schema.id),
+            ),
+        )
+
+    async def _rerender_good(self, callback: CallbackQuery, good_schema: GoodSchema) -> None:
+        view = self._render_good(good_schema)
+        text, markup = view.text, view.markup
+        try:
+            if callback.message and callback.message.photo:
+                await callback.message.edit_caption(caption=text, reply_markup=markup)
+            elif callback.message:
+                await callback.message.edit_text(text=text, reply_markup=markup)
+            else:
+                try:
+                    await self._bot.edit_message_text(
+                        text=text, inline_message_id=callback.inline_message_id, reply_markup=markup
+                    )
+                except TelegramBadRequest:  # inline result sent as a photo
+                    await self._bot.edit_message_caption(
+                        caption=text, inline_message_id=callback.inline_message_id, reply_markup=markup
+                    )
+        except TelegramBadRequest as e:
+            logger.info(f"Stale good {good_schema.id} not re-rendered: {e}")
+
+    def _handle_inline_query(self) -> None:
+        @self._dp.inline_query()
+        async def handle(inline_query: InlineQuery) -> None:
+            results = await self._inline_catalog.get_results(inline_query.query)
+            await inline_query.answer(results, cache_time=self._inline_catalog.cache_time)
 
     def _handle_cart(self) -> None:
         @self._dp.message(F.text == TextConstants.CART.value)
@@ -289,6 +468,37 @@ class ShopBot:
                 reply_markup=builder.as_markup(),
             )
 
+    def _handle_my_orders(self) -> None:
+        @self._dp.message(F.text == TextConstants.MY_ORDERS.value)
+        async def handle(msg: Message) -> None:
+            await self._send_orders_page(msg, msg.chat.id, None)
+
+    def _handle_orders_page(self) -> None:
+        @self._dp.callback_query(OrdersPageCallback.filter())
+        async def handle(callback: CallbackQuery, callback_data: OrdersPageCallback) -> None:
+            await callback.message.edit_reply_markup(reply_markup=None)
+            await self._send_orders_page(callback.message, callback.message.chat.id, callback_data.before_id)
+            await callback.answer()
+
+    async def _send_orders_page(self, msg: Message, chat_id: int, before_id: int | None) -> None:
+        try:
+            text, next_before_id = await self._service.show_user_orders(chat_id, before_id)
+        except UserDoesNotExist as e:
+            await msg.answer(text=str(e))
+            return
+        if not text:
+            await msg.answer(text=TextConstants.NO_USER_ORDERS.value)
+            return
+        markup = None
+        if next_before_id is not None:
+            builder = InlineKeyboardBuilder()
+            builder.button(
+                text=TextConstants.MORE_ORDERS.value,
+                callback_data=OrdersPageCallback(before_id=next_before_id),
+            )
+            markup = builder.as_markup()
+        await msg.answer(text=text, reply_markup=markup)
+
     def _handle_cart_goods(self) -> None:
         @self._dp.callback_query(F.data == TextConstants.OPEN_CART.value)
         async def handle(callback: CallbackQuery) -> None:
@@ -298,37 +508,46 @@ class ShopBot:
             except UserDoesNotExist as e:
                 await callback.message.answer(text=str(e))
                 await callback.answer()
+                return
+            catalog_version = await self._service.get_catalog_version()
             for cart_good_schema in cart_goods_schemas:
-                good_id = cart_good_schema.id
-                builder = InlineKeyboardBuilder()
-                builder.button(
-                    text=TextConstants.DELETE_GOOD.value,
-                    callback_data=f"Delete:{good_id}",
-                )
-                builder.button(
-                    text=TextConstants.CHANGE_QUANTITY.value,
-                    callback_data=f"Quantity:{good_id}",
+                view = self._render_cache.get_or_render(
+                    cart_good_schema.id,
+                    catalog_version,
+                    ViewKind.CART_GOOD,
+                    lambda: self._build_cart_good_view(cart_good_schema),
+                    cart_good_schema.quantity,
                 )
-                text = self._service.display_good_in_cart(cart_good_schema)
-                await callback.message.answer(text=text, reply_markup=builder.as_markup())
+                await callback.message.answer(text=view.text, reply_markup=view.markup)
             total_cost = await self._service.display_total_cost(chat_id)
             await callback.message.answer(text=total_cost)
             await callback.answer()
 
+    def _build_cart_good_view(self, cart_good_schema: CartGoodSchema) -> RenderedView:
+        builder = InlineKeyboardBuilder()
+        builder.button(
+            text=TextConstants.DELETE_GOOD.value,
+            callback_data=DeleteGoodCallback(good_id=cart_good_schema.id),
+        )
+        builder.button(
+            text=TextConstants.CHANGE_QUANTITY.value,
+            callback_data=QuantityCallback(good_id=cart_good_schema.id),
+        )
+        text = self._service.display_good_in_cart(cart_good_schema)
+        return RenderedView(text=text, markup=builder.as_markup())
+
     def _handle_delete_good_from_cart(self) -> None:
-        @self._dp.callback_query(F.data.startswith("Delete:"))
-        async def handle(callback: CallbackQuery) -> None:
+        @self._dp.callback_query(DeleteGoodCallback.filter())
+        async def handle(callback: CallbackQuery, callback_data: DeleteGoodCallback) -> None:
             chat_id = callback.message.chat.id
-            good_id = int(callback.data.split(":")[1])
-            text = await self._service.delete_good_from_cart(chat_id, good_id)
+            text = await self._service.delete_good_from_cart(chat_id, callback_data.good_id)
             await callback.message.answer(text=text)
             await callback.answer()
 
     def _handle_request_quantity(self) -> None:
-        @self._dp.callback_query(F.data.startswith("Quantity:"))
-        async def handle(callback: CallbackQuery, state: FSMContext) -> None:
-            good_id = callback.data.split(":")[1]
-            await state.update_data(good_id=good_id)
+        @self._dp.callback_query(QuantityCallback.filter())
+        async def handle(callback: CallbackQuery, callback_data: QuantityCallback, state: FSMContext) -> None:
+            await state.update_data(good_id=callback_data.good_id)
             await callback.message.answer(text=TextConstants.REQUEST_QUANTITY.value)
             await state.set_state(QuantityChange.waiting_for_number)
             await callback.answer()
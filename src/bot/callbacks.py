@@ -0,0 +1,22 @@
+from aiogram.filters.callback_data import CallbackData
+
+
+class CategoryCallback(CallbackData, prefix="c"):
+    category_id: int
+
+
+class AddGoodCallback(CallbackData, prefix="a"):
+    good_id: int
+    version: int  # catalog version the button was rendered with
+
+
+class DeleteGoodCallback(CallbackData, prefix="d"):
+    good_id: int
+
+
+class QuantityCallback(CallbackData, prefix="q"):
+    good_id: int
+
+
+class OrdersPageCallback(CallbackData, prefix="o"):
+    before_id: int  # keyset cursor: id of the last order on the previous page
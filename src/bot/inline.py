@@ -0,0 +1,112 @@
+import logging
+
+from aiogram.types import (
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InlineQueryResultUnion,
+    InputTextMessageContent,
+)
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from src.bot.cache import LRUCache
+from src.bot.callbacks import AddGoodCallback
+from src.bot.schemas import CategorieSchema, GoodSchema
+from src.bot.service import Service
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 50  # Telegram limit for one answerInlineQuery call
+
+
+class InlineCatalog:
+    def __init__(
+        self,
+        service: Service,
+        add_button_text: str,
+        cache_size: int,
+        cache_time: int,
+        photos_base_url: str | None = None,
+    ) -> None:
+        self._service = service
+        self._photos_base_url = photos_base_url
+        self._add_button_text = add_button_text
+        self._results: LRUCache[str, list[InlineQueryResultUnion]] = LRUCache(cache_size)
+        self.cache_time = cache_time
+        self._catalog: list[CategorieSchema] | None = None
+        self._by_category: dict[str, list[InlineQueryResultUnion]] = {}
+        self._by_good: list[tuple[str, InlineQueryResultUnion]] = []
+
+    async def get_results(self, query: str) -> list[InlineQueryResultUnion]:
+        catalog = await self._service.get_validated_categories_goods()
+        if catalog is not self._catalog:
+            self._precompute(catalog)
+        key = query.strip().lower()
+        results = self._results.get(key)
+        if results is None:
+            results = self._match(key)
+            self._results.set(key, results)
+        return results
+
+    def invalidate(self) -> None:
+        self._catalog = None
+
+    def _precompute(self, catalog: list[CategorieSchema]) -> None:
+        self._results.clear()
+        self._by_category = {}
+        self._by_good = []
+        for category_schema in catalog:
+            category_results = []
+            for good_schema in category_schema.goods:
+                callback_data = AddGoodCallback(good_id=good_schema.id, version=self._service.catalog_version)
+                result = self._build_result(good_schema, callback_data)
+                category_results.append(result)
+                self._by_good.append((good_schema.name.lower(), result))
+            self._by_category[category_schema.name.lower()] = category_results
+        self._catalog = catalog
+        logger.info(f"Inline results precomputed for {len(self._by_good)} goods")
+
+    def _match(self, key: str) -> list[InlineQueryResultUnion]:
+        if not key:
+            return [result for _, result in self._by_good][:MAX_RESULTS]
+        results = []
+        seen = set()
+        for category_name, category_results in self._by_category.items():
+            if category_name.startswith(key):
+                for result in category_results:
+                    if result.id not in seen:
+                        seen.add(result.id)
+                        results.append(result)
+        for good_name, result in self._by_good:
+            if key in good_name and result.id not in seen:
+                seen.add(result.id)
+                results.append(result)
+        return results[:MAX_RESULTS]
+
+    def _build_result(self, good_schema: GoodSchema, callback_data: AddGoodCallback) -> InlineQueryResultUnion:
+        text = self._service.display_good_base(good_schema)["text"]
+        markup = self._build_markup(callback_data)
+        file_id = self._service.get_photo_file_id(good_schema.id)
+        if file_id:
+            return InlineQueryResultCachedPhoto(
+                id=str(good_schema.id),
+                photo_file_id=file_id,
+                caption=text,
+                reply_markup=markup,
+            )
+        thumbnail_url = None
+        if self._photos_base_url and good_schema.photo_thumb_path:
+            thumbnail_url = f"{self._photos_base_url.rstrip('/')}/{good_schema.photo_thumb_path}"
+        return InlineQueryResultArticle(
+            id=str(good_schema.id),
+            title=good_schema.name,
+            description=f"{good_schema.price}",
+            input_message_content=InputTextMessageContent(message_text=text),
+            reply_markup=markup,
+            thumbnail_url=thumbnail_url,
+        )
+
+    def _build_markup(self, callback_data: AddGoodCallback) -> InlineKeyboardMarkup:
+        builder = InlineKeyboardBuilder()
+        builder.button(text=self._add_button_text, callback_data=callback_data)
+        return builder.as_markup()
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from src.bot.sender import ThrottledSender
+from src.bot.service import Service
+
+logger = logging.getLogger(__name__)
+
+CART_REMINDER = "В вашей корзине остались товары. Оформите заказ, пока они в наличии!"
+
+
+class AbandonedCartJob:
+    def __init__(
+        self,
+        service: Service,
+        sender: ThrottledSender,
+        interval: float,
+        abandoned_after: timedelta,
+        retention: timedelta,
+        batch_size: int,
+        purge_chunk_size: int,
+    ) -> None:
+        self._service = service
+        self._sender = sender
+        self._interval = interval
+        self._abandoned_after = abandoned_after
+        self._retention = retention
+        self._batch_size = batch_size
+        self._purge_chunk_size = purge_chunk_size
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> None:
+        # Purge first so that carts about to be emptied are not reminded about
+        await self._service.purge_expired_carts(self._retention, self._purge_chunk_size)
+        reminded: set[int] = set()
+        while True:
+            # Carts are marked as reminded when popped, so the next batch is popped only once this one is sent.
+            # Otherwise a large backlog would be marked at once and lost if the process stops before sending it.
+            await self._sender.wait_sent()
+            chat_ids = await self._service.pop_abandoned_carts_chats(self._abandoned_after, self._batch_size)
+            new_chat_ids = set(chat_ids) - reminded
+            for chat_id in new_chat_ids:
+                await self._sender.send(chat_id, CART_REMINDER)
+            reminded |= new_chat_ids
+            # A batch without new carts means the marks are not taking effect, stop instead of spinning
+            if len(chat_ids) < self._batch_size or not new_chat_ids:
+                break
+        if reminded:
+            logger.info(f"{len(reminded)} abandoned cart reminders queued")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Abandoned cart job failed: {e}")
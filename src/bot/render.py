@@ -0,0 +1,63 @@
+import logging
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from enum import Enum
+
+from aiogram.types import InlineKeyboardMarkup
+
+from src.bot.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class ViewKind(Enum):
+    GOOD = "good"
+    CART_GOOD = "cart_good"
+
+
+@dataclass(frozen=True, slots=True)
+class RenderedView:
+    text: str
+    markup: InlineKeyboardMarkup
+
+
+class RenderCache:
+    def __init__(self, max_size: int) -> None:
+        self._cache: LRUCache[tuple[Hashable, ...], RenderedView] = LRUCache(max_size)
+        self._catalog_version: int | None = None
+
+    def get_or_render(
+        self,
+        good_id: int,
+        catalog_version: int,
+        view_kind: ViewKind,
+        render: Callable[[], RenderedView],
+        *extra_key: Hashable,
+    ) -> RenderedView:
+        if catalog_version != self._catalog_version:
+            self.invalidate()
+            self._catalog_version = catalog_version
+        key = (good_id, catalog_version, view_kind, *extra_key)
+        view = self._cache.get(key)
+        if view is None:
+            view = render()
+            self._cache.set(key, view)
+        return view
+
+    def invalidate(self) -> None:
+        if self._catalog_version is not None:
+            logger.info(f"Render cache invalidated, {self.stats()}")
+        self._cache.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self._cache.hits + self._cache.misses
+        return self._cache.hits / total if total else 0.0
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "size": len(self._cache),
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+            "hit_rate": round(self.hit_rate, 3),
+        }
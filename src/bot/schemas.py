@@ -1,36 +1,71 @@
+from datetime import datetime
 from decimal import Decimal
+from typing import NamedTuple
 from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from src.db.models import DeliveryTypes
 
 
-class GoodSchema(BaseModel):
+# Read models are plain tuples built straight from Core select() rows: no validation on hot paths
+class GoodSchema(NamedTuple):
     id: int
     name: str
     description: str
     price: Decimal
     photo_file_path: str | None
+    photo_processed_path: str | None
+    photo_thumb_path: str | None
+    photo_file_id: str | None
 
 
-class CategorieSchema(BaseModel):
+class CategorieSchema(NamedTuple):
     id: int
     name: str
     goods: list[GoodSchema]
 
 
-class CartGoodSchema(BaseModel):
+class CartGoodSchema(NamedTuple):
     id: int
     name: str
     price: Decimal
     quantity: int
 
 
-class OrderSchema(BaseModel):
+class OrderSchema(NamedTuple):
     id: int
     number: UUID
     is_approved: bool
     delivery_type: DeliveryTypes
     status: str
     user_id: int
+
+
+class UserOrderSchema(NamedTuple):
+    id: int
+    number: UUID
+    delivery_type: DeliveryTypes
+    status: str
+    created_at: datetime
+
+
+class OrderGoodSchema(NamedTuple):
+    order_id: int
+    name: str
+    quantity: int
+    price: Decimal
+
+
+class GoodInputSchema(BaseModel):
+    name: str = Field(min_length=1, max_length=128)
+    description: str = Field(max_length=256)
+    price: Decimal = Field(gt=0, max_digits=10, decimal_places=2)
+    category_name: str
+
+
+class GoodUpdateSchema(BaseModel):
+    name: str | None = Field(default=None, min_length=1, max_length=128)
+    description: str | None = Field(default=None, max_length=256)
+    price: Decimal | None = Field(default=None, gt=0, max_digits=10, decimal_places=2)
+    category_name: str
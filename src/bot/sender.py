@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottledSender:
+    def __init__(self, bot_obj: Bot, rate_per_second: float, max_queued: int) -> None:
+        self._bot = bot_obj
+        self._interval = 1 / rate_per_second
+        # Bounded, so that producers wait for sending instead of piling up hours of messages in memory
+        self._queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue(max_queued)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float) -> None:
+        if not self._task:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._queue.qsize()} outbound messages dropped on shutdown")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def send(self, chat_id: int, text: str) -> None:
+        await self._queue.put((chat_id, text))
+
+    async def wait_sent(self) -> None:
+        await self._queue.join()
+
+    async def _run(self) -> None:
+        while True:
+            chat_id, text = await self._queue.get()
+            try:
+                await self._send(chat_id, text)
+            finally:
+                self._queue.task_done()
+            await asyncio.sleep(self._interval)
+
+    async def _send(self, chat_id: int, text: str) -> None:
+        while True:
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text)
+                return
+            except TelegramRetryAfter as e:
+                logger.info(f"Flood limit hit, retry in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                logger.info(f"Bot is blocked by {chat_id=}, message skipped")
+                return
+            except Exception as e:
+                logger.error(f"Message to {chat_id=} not sent: {e}")
+                return
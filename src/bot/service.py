@@ -1,20 +1,38 @@
+import asyncio
 import logging
-from decimal import Decimal
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 from uuid import UUID
 
+from pydantic import BaseModel
+
+from src.bot.cache import LRUCache
 from src.bot.exceptions import WrongContactsInput
 from src.bot.schemas import (
     CartGoodSchema,
     CategorieSchema,
+    GoodInputSchema,
     GoodSchema,
+    GoodUpdateSchema,
+    OrderGoodSchema,
     OrderSchema,
+    UserOrderSchema,
 )
+from src.db.cart_buffer import CartWriteBuffer
 from src.db.models import DeliveryTypes
 from src.db.repository import Repository
+from src.images import ProcessedImage
+from src.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+STATS_DEFAULT_DAYS = 7
+STATS_TOP_GOODS = 5
+STATS_MAX_DAYS = 3660
+ORDERS_PAGE_SIZE = 5
+
 
 class TextConstants(Enum):
     QUANTITY_CHANGED = "Количество товара в корзине успешно изменено"
@@ -23,52 +41,192 @@ class TextConstants(Enum):
     SUCCESSFUL_UPDATE = "Успешное обновление данных"
 
 
+@tracer.trace_methods("service")
 class Service:
-    def __init__(self, repository: Repository) -> None:
+    def __init__(
+        self,
+        repository: Repository,
+        cart_buffer: CartWriteBuffer | None = None,
+        user_cache_size: int = 10_000,
+        order_view_cache_size: int = 5_000,
+        catalog_ttl: float = 60,
+        order_view_ttl: float = 300,
+    ) -> None:
         self._repository = repository
+        self._cart_buffer = cart_buffer
+        self._catalog: list[CategorieSchema] | None = None
+        self._catalog_ttl = catalog_ttl
+        self._catalog_loaded_at = 0.0
+        self._catalog_invalidated = False
+        self._catalog_generation = 0
+        self._catalog_lock = asyncio.Lock()
+        self._categories_by_id: dict[int, CategorieSchema] = {}
+        self._goods_by_id: dict[int, GoodSchema] = {}
+        self.catalog_version = 0
+        self._photo_file_ids: dict[int, str] = {}
+        self._user_carts: LRUCache[int, tuple[int, int]] = LRUCache(user_cache_size)
+        # Rendered order and when it was rendered. The TTL picks up status changes made on other nodes
+        self._order_views: LRUCache[int, tuple[str, float]] = LRUCache(order_view_cache_size)
+        self._order_view_ttl = order_view_ttl
+        # Orders changed by this node, re-read from the primary on their next render
+        self._changed_orders: LRUCache[int, bool] = LRUCache(order_view_cache_size)
 
     async def get_validated_categories_goods(self) -> list[CategorieSchema]:
-        categories = await self._repository.get_all_categories_goods()
+        # The TTL picks up catalog changes made by scripts or other nodes, not only by this process
+        if self._catalog_is_fresh():
+            return self._catalog
+        # One load at a time, concurrent updates wait for it instead of running the same full query
+        async with self._catalog_lock:
+            if self._catalog_is_fresh():
+                return self._catalog
+            return await self._load_catalog()
+
+    def _catalog_is_fresh(self) -> bool:
+        return self._catalog is not None and time.monotonic() - self._catalog_loaded_at < self._catalog_ttl
+
+    async def _load_catalog(self) -> list[CategorieSchema]:
+        generation = self._catalog_generation
+        # Right after an edit the replica may still return the old catalog, which would then stay cached
+        rows = await self._repository.get_all_categories_goods(primary=self._catalog_invalidated)
         schemas = []
-        for category in categories:
-            category_schema = CategorieSchema(
-                id=category.id,
-                name=category.name,
-                goods=[GoodSchema.model_validate(good, from_attributes=True) for good in category.goods],
-            )
-            schemas.append(category_schema)
+        for row in rows:
+            if not schemas or schemas[-1].id != row[0]:
+                schemas.append(CategorieSchema(id=row[0], name=row[1], goods=[]))
+            if row[2] is not None:  # category without goods
+                schemas[-1].goods.append(GoodSchema._make(row[2:]))
+        if generation == self._catalog_generation:  # not invalidated while loading
+            self._index_catalog(schemas)
+            self._catalog_invalidated = False
         return schemas
 
+    async def get_category(self, category_id: int) -> CategorieSchema | None:
+        await self.get_validated_categories_goods()
+        return self._categories_by_id.get(category_id)
+
+    async def get_good(self, good_id: int) -> GoodSchema | None:
+        await self.get_validated_categories_goods()
+        return self._goods_by_id.get(good_id)
+
+    async def get_catalog_version(self) -> int:
+        await self.get_validated_categories_goods()
+        return self.catalog_version
+
+    def invalidate_catalog(self) -> None:
+        self._catalog = None
+        self._catalog_invalidated = True
+        self._catalog_generation += 1
+        logger.info("Catalog cache invalidated")
+
+    def _index_catalog(self, schemas: list[CategorieSchema]) -> None:
+        self._categories_by_id = {category_schema.id: category_schema for category_schema in schemas}
+        self._goods_by_id = {
+            good_schema.id: good_schema for category_schema in schemas for good_schema in category_schema.goods
+        }
+        # Content-derived, so buttons rendered before a restart or by another node stay valid
+        fingerprint = repr(
+            sorted(
+                (category_schema.id, good_schema.id, good_schema.name, good_schema.description, str(good_schema.price))
+                for category_schema in schemas
+                for good_schema in category_schema.goods
+            )
+        )
+        self.catalog_version = zlib.crc32(fingerprint.encode())
+        self._catalog = schemas
+        self._catalog_loaded_at = time.monotonic()
+
+    def get_photo_file_id(self, good_id: int) -> str | None:
+        file_id = self._photo_file_ids.get(good_id)
+        if file_id:
+            return file_id
+        good_schema = self._goods_by_id.get(good_id)
+        return good_schema.photo_file_id if good_schema else None
+
+    async def save_photo_file_id(self, good_id: int, file_id: str) -> None:
+        # Kept aside from the catalog so that saving does not force a catalog reload
+        self._photo_file_ids[good_id] = file_id
+        await self._repository.set_photo_file_id(good_id, file_id)
+
+    async def get_good_id_by_name(self, good_name: str) -> int | None:
+        return await self._repository.get_good_id_by_name(good_name)
+
+    async def set_good_photo(self, good_name: str, file_id: str, processed: ProcessedImage) -> str:
+        # The seed file is dropped, otherwise process_photos would bring the old photo back
+        values = {
+            "photo_file_path": None,
+            "photo_file_id": file_id,
+            "photo_hash": processed.content_hash,
+            "photo_processed_path": processed.photo_path,
+            "photo_thumb_path": processed.thumb_path,
+        }
+        try:
+            good_id = await self._repository.update_good_photo(good_name, values)
+        except ValueError as e:
+            logger.info(f"{e}")
+            return TextConstants.INCORRECT_INPUT.value
+        self._photo_file_ids.pop(good_id, None)
+        self.invalidate_catalog()
+        return TextConstants.SUCCESSFUL_UPDATE.value
+
     def display_good_base(self, good_schema: GoodSchema) -> dict[str, str]:
         res = f"Название: {good_schema.name}\nОписание: {good_schema.description}\nЦена: {good_schema.price}"
-        return {"text": res, "photo_path": good_schema.photo_file_path}
+        return {"text": res, "photo_path": good_schema.photo_processed_path or good_schema.photo_file_path}
 
     async def create_cart_user(self, chat_id: int) -> None:
         await self._repository.create_cart_user(chat_id)
         logger.info(f"User with {chat_id=} created")
 
     async def check_user_existance(self, chat_id: int) -> None:
-        await self._repository.get_user_by_chat_id(chat_id)
+        await self._get_user_cart_ids(chat_id)
         logger.info(f"User with {chat_id=} already exists")
 
+    async def _get_user_cart_ids(self, chat_id: int) -> tuple[int, int]:
+        # chat -> (user, cart) never changes once created, so it is safe to cache
+        ids = self._user_carts.get(chat_id)
+        if ids is None:
+            ids = tuple(await self._repository.get_user_cart_ids(chat_id))
+            self._user_carts.set(chat_id, ids)
+        return ids
+
+    async def warm_up(self, users_count: int) -> None:
+        await self.get_validated_categories_goods()
+        rows = await self._repository.get_recent_users_cart_ids(users_count)
+        for chat_id, user_id, cart_id in reversed(rows):
+            self._user_carts.set(chat_id, (user_id, cart_id))
+        logger.info(f"Caches warmed up: {len(self._goods_by_id)} goods, {len(rows)} users")
+
     async def add_good_in_cart(self, chat_id: int, good_id: int) -> str | None:
-        user = await self._repository.get_user_by_chat_id(chat_id)
-        cart = await self._repository.get_cart_by_user_id(user.id)
-        await self._repository.add_good_in_cart(cart.id, good_id)
+        _, cart_id = await self._get_user_cart_ids(chat_id)
+        if self._cart_buffer:
+            await self._cart_buffer.add(cart_id, good_id, chat_id)
+        else:
+            await self._repository.add_good_in_cart(cart_id, good_id)
 
     async def get_goods_from_cart(self, chat_id: int) -> list[CartGoodSchema] | str:
-        user = await self._repository.get_user_by_chat_id(chat_id)
-        cart = await self._repository.get_cart_by_user_id(user.id)
-        quantity = await self._repository.get_good_quantity(cart.id)
-        return [
-            CartGoodSchema(
-                id=good.id,
-                name=good.name,
-                price=good.price,
-                quantity=quantity[good.id],
-            )
-            for good in cart.goods
-        ]
+        _, cart_id = await self._get_user_cart_ids(chat_id)
+        rows = await self._repository.get_cart_goods(cart_id)
+        schemas = [CartGoodSchema._make(row) for row in rows]
+        if self._cart_buffer:
+            schemas = await self._merge_pending_goods(cart_id, schemas)
+        return schemas
+
+    async def _merge_pending_goods(self, cart_id: int, schemas: list[CartGoodSchema]) -> list[CartGoodSchema]:
+        pending = self._cart_buffer.pending_for_cart(cart_id)
+        if not pending:
+            return schemas
+        merged = []
+        for schema in schemas:
+            merged.append(schema._replace(quantity=schema.quantity + pending.pop(schema.id, 0)))
+        for good_id, delta in pending.items():
+            good_schema = await self.get_good(good_id)
+            if good_schema:
+                merged.append(
+                    CartGoodSchema(id=good_id, name=good_schema.name, price=good_schema.price, quantity=delta)
+                )
+        return merged
+
+    async def _flush_cart_buffer(self) -> None:
+        if self._cart_buffer:
+            await self._cart_buffer.flush()
 
     def display_good_in_cart(self, cart_good_schema: CartGoodSchema) -> str:
         return f"Название: {cart_good_schema.name}\nКоличество: {cart_good_schema.quantity}"
@@ -81,27 +239,37 @@ class Service:
         return f"Стоимость корзины: {res}"
 
     async def change_quantity(self, chat_id: int, good_id: int, new_quantity: int) -> str:
-        user = await self._repository.get_user_by_chat_id(chat_id)
-        cart = await self._repository.get_cart_by_user_id(user.id)
-        await self._repository.change_good_quantity(cart.id, good_id, new_quantity)
+        _, cart_id = await self._get_user_cart_ids(chat_id)
+        await self._flush_cart_buffer()
+        await self._repository.change_good_quantity(cart_id, good_id, new_quantity)
         return TextConstants.QUANTITY_CHANGED.value
 
     async def delete_good_from_cart(self, chat_id: int, good_id: int) -> str:
-        user = await self._repository.get_user_by_chat_id(chat_id)
-        cart = await self._repository.get_cart_by_user_id(user.id)
-        await self._repository.delete_good_from_cart(cart.id, good_id)
+        _, cart_id = await self._get_user_cart_ids(chat_id)
+        await self._flush_cart_buffer()
+        await self._repository.delete_good_from_cart(cart_id, good_id)
         return TextConstants.GOOD_REMOVED.value
 
+    async def pop_abandoned_carts_chats(self, abandoned_after: timedelta, batch_size: int) -> list[int]:
+        return await self._repository.pop_abandoned_carts(datetime.now(timezone.utc) - abandoned_after, batch_size)
+
+    async def purge_expired_carts(self, retention: timedelta, chunk_size: int) -> int:
+        deleted = await self._repository.purge_expired_carts(datetime.now(timezone.utc) - retention, chunk_size)
+        if deleted:
+            logger.info(f"{deleted} expired cart goods purged")
+        return deleted
+
     async def add_user_contacts(self, chat_id: int, contacts: str) -> str:
         valid_contacts = contacts.split(",")
         if len(valid_contacts) != 3:
             raise WrongContactsInput()
-        user = await self._repository.get_user_by_chat_id(chat_id)
-        await self._repository.add_user_contacts(user.id, valid_contacts[0], valid_contacts[1], valid_contacts[2])
+        user_id, _ = await self._get_user_cart_ids(chat_id)
+        await self._repository.add_user_contacts(user_id, valid_contacts[0], valid_contacts[1], valid_contacts[2])
 
     async def create_order(self, chat_id: int, delivery_type: DeliveryTypes) -> UUID:
-        user = await self._repository.get_user_by_chat_id(chat_id)
-        order = await self._repository.create_order(user.id, delivery_type)
+        user_id, cart_id = await self._get_user_cart_ids(chat_id)
+        await self._flush_cart_buffer()
+        order = await self._repository.create_order(user_id, cart_id, delivery_type)
         await self._repository.change_order_approvement(order.id, True)
         return order.number
 
@@ -110,16 +278,76 @@ class Service:
         return f"Ваши контактные данные:\nФИО:{user.full_name}\nТелефон:{user.phone}\nАдрес:{user.adress}"
 
     async def show_orders(self) -> str:
-        order_objects = await self._repository.show_orders()
+        rows = await self._repository.show_orders()
         res = ""
-        for order_obj in order_objects:
-            schema = OrderSchema.model_validate(order_obj, from_attributes=True)
+        for row in rows:
+            schema = OrderSchema._make(row)
             res += (
                 f"id: {schema.id}, номер: {schema.number}, способ доставки: {schema.delivery_type.value}, "
                 f"статус: {schema.status}, user_id: {schema.user_id}\n\n"
             )
         return res
 
+    async def show_user_orders(self, chat_id: int, before_id: int | None = None) -> tuple[str, int | None]:
+        user_id, _ = await self._get_user_cart_ids(chat_id)
+        rows = await self._repository.get_user_orders(user_id, before_id, ORDERS_PAGE_SIZE + 1)
+        changed = [row.id for row in rows[:ORDERS_PAGE_SIZE] if self._changed_orders.get(row.id)]
+        if changed:
+            # The status was changed from the admin's chat, so the replica may still return the old one
+            rows = await self._repository.get_user_orders(user_id, before_id, ORDERS_PAGE_SIZE + 1, primary=True)
+            for order_id in changed:
+                self._changed_orders.pop(order_id)
+        schemas = [UserOrderSchema._make(row) for row in rows[:ORDERS_PAGE_SIZE]]
+        now = time.monotonic()
+        views = {}
+        for schema in schemas:
+            cached = self._order_views.get(schema.id)
+            if cached is not None and now - cached[1] < self._order_view_ttl:
+                views[schema.id] = cached[0]
+        missing = [schema for schema in schemas if schema.id not in views]
+        if missing:
+            goods_by_order: dict[int, list[OrderGoodSchema]] = {}
+            for row in await self._repository.get_orders_goods([schema.id for schema in missing]):
+                goods_by_order.setdefault(row.order_id, []).append(OrderGoodSchema._make(row))
+            for schema in missing:
+                views[schema.id] = self._display_user_order(schema, goods_by_order.get(schema.id, []))
+                self._order_views.set(schema.id, (views[schema.id], now))
+        next_before_id = schemas[-1].id if len(rows) > ORDERS_PAGE_SIZE else None
+        return "\n\n".join(views[schema.id] for schema in schemas), next_before_id
+
+    def _display_user_order(self, schema: UserOrderSchema, goods_schemas: list[OrderGoodSchema]) -> str:
+        res = (
+            f"Заказ {schema.number} от {schema.created_at:%d.%m.%Y}\n"
+            f"Статус: {schema.status}, способ доставки: {schema.delivery_type.value}\n"
+        )
+        total = 0
+        for good_schema in goods_schemas:
+            res += f"{good_schema.name}: {good_schema.quantity} x {good_schema.price}\n"
+            total += good_schema.quantity * good_schema.price
+        return res + f"Итого: {total}"
+
+    async def show_stats(self, days_str: str | None) -> str:
+        try:
+            days = int(days_str) if days_str else STATS_DEFAULT_DAYS
+        except ValueError:
+            return TextConstants.INCORRECT_INPUT.value
+        if not 1 <= days <= STATS_MAX_DAYS:
+            return TextConstants.INCORRECT_INPUT.value
+        since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+        daily_rows = await self._repository.get_daily_sales(since)
+        top_rows = await self._repository.get_top_goods(since, STATS_TOP_GOODS)
+        if not daily_rows:
+            return ""
+        res = f"Продажи за {days} дн.:\n"
+        for day, orders_count, items_count, revenue in daily_rows:
+            res += f"{day}: заказов {orders_count}, товаров {items_count}, выручка {revenue}\n"
+        total_orders = sum(row.orders_count for row in daily_rows)
+        total_revenue = sum(row.revenue for row in daily_rows)
+        res += f"\nИтого: заказов {total_orders}, выручка {total_revenue}\n\nТоп товаров:\n"
+        for name, quantity, revenue in top_rows:
+            res += f"{name}: {quantity} шт., выручка {revenue}\n"
+        return res
+
     async def change_order_status(self, values_str: str) -> str:
         spl = values_str.split(",")
         if len(spl) != 2:
@@ -127,6 +355,8 @@ class Service:
         try:
             order_id, new_status = int(spl[0]), spl[1]
             await self._repository.change_order_status(order_id, new_status)
+            self._order_views.pop(order_id)
+            self._changed_orders.set(order_id, True)
             msg = TextConstants.SUCCESSFUL_UPDATE.value
         except Exception:
             msg = TextConstants.INCORRECT_INPUT.value
@@ -136,11 +366,12 @@ class Service:
         try:
             values = values_str.split(",")
             good_name = values.pop(-1)
-            valid_values = self._validate_good_input(values)
+            valid_values = self._validate_good_input(values, GoodUpdateSchema)
             category_name = valid_values.pop("category_name")
             category_id = await self._repository.get_category_id_by_name(category_name)
             valid_values["category_id"] = category_id
             await self._repository.update_good(good_name, valid_values)
+            self.invalidate_catalog()
             msg = TextConstants.SUCCESSFUL_UPDATE.value
         except Exception as e:
             logger.info(f"{e}")
@@ -150,24 +381,24 @@ class Service:
     async def add_good(self, values_str: str) -> str:
         try:
             values = values_str.split(",")
-            valid_values = self._validate_good_input(values)
+            valid_values = self._validate_good_input(values, GoodInputSchema)
             category_name = valid_values.pop("category_name")
             category_id = await self._repository.get_category_id_by_name(category_name)
             valid_values["category_id"] = category_id
             await self._repository.add_good(valid_values)
+            self.invalidate_catalog()
             msg = TextConstants.SUCCESSFUL_UPDATE.value
         except Exception as e:
             logger.info(f"{e}")
             msg = TextConstants.INCORRECT_INPUT.value
         return msg
 
-    def _validate_good_input(self, values: list[str]) -> dict:
-        valid_values = {}
+    def _validate_good_input(self, values: list[str], schema: type[BaseModel]) -> dict:
+        raw_values = {}
         for value in values:
             spl = value.split(":")
             key, value = spl[0], spl[1]
-            if key == "price":
-                value = Decimal(value)
-            valid_values[key] = value
+            raw_values[key] = value
+        valid_values = schema.model_validate(raw_values).model_dump(exclude_none=True)
         logger.info(f"{valid_values=}")
         return valid_values
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+from sqlalchemy.exc import IntegrityError
+
+from src.db.repository import Repository
+
+logger = logging.getLogger(__name__)
+
+CLOSE_FLUSH_ATTEMPTS = 3
+CLOSE_RETRY_DELAY = 1
+
+
+class CartWriteBuffer:
+    def __init__(self, repository: Repository, flush_interval: float, max_pending: int) -> None:
+        self._repository = repository
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._pending: dict[tuple[int, int], int] = {}
+        self._pending_chats: dict[int, int] = {}  # cart_id -> chat_id
+        self._pending_ops = 0
+        self._in_flight: dict[tuple[int, int], int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(1, CLOSE_FLUSH_ATTEMPTS + 1):
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"Cart buffer flush on close failed, attempt {attempt}/{CLOSE_FLUSH_ATTEMPTS}: {e}")
+            if attempt < CLOSE_FLUSH_ATTEMPTS:
+                await asyncio.sleep(CLOSE_RETRY_DELAY)
+        # Logged as (cart_id, good_id) -> quantity so that they can be restored by hand
+        logger.error(f"{self._pending_ops} buffered cart adds lost on shutdown: {self._pending}")
+
+    async def add(self, cart_id: int, good_id: int, chat_id: int | None = None) -> None:
+        key = (cart_id, good_id)
+        self._pending[key] = self._pending.get(key, 0) + 1
+        if chat_id is not None:
+            self._pending_chats[cart_id] = chat_id
+        self._pending_ops += 1
+        if self._pending_ops >= self._max_pending:
+            try:
+                await self.flush()
+            except Exception as e:
+                # The add itself is kept in the buffer, failing here would make the user add it again
+                logger.error(f"Cart buffer flush failed: {e}")
+
+    def pending_for_cart(self, cart_id: int) -> dict[int, int]:
+        res = {}
+        for deltas in (self._in_flight, self._pending):
+            for (pending_cart_id, good_id), delta in deltas.items():
+                if pending_cart_id == cart_id:
+                    res[good_id] = res.get(good_id, 0) + delta
+        return res
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, chats, ops = self._pending, self._pending_chats, self._pending_ops
+            self._in_flight = batch  # still visible to readers until committed
+            self._pending, self._pending_chats, self._pending_ops = {}, {}, 0
+            try:
+                # Chats are marked as recent writers, so their next cart read does not hit a lagging replica
+                await self._repository.add_goods_in_cart(batch, set(chats.values()))
+                logger.info(f"Cart buffer flushed {ops} adds as {len(batch)} rows")
+            except Exception as e:
+                logger.warning(f"Cart buffer flush of {len(batch)} rows failed, retrying row by row: {e}")
+                await self._flush_by_row(batch, chats)
+            finally:
+                self._in_flight = {}
+
+    async def _flush_by_row(self, batch: dict[tuple[int, int], int], chats: dict[int, int]) -> None:
+        # A row that can never be written (e.g. a good deleted by a script) must not hold back the others
+        retry: dict[tuple[int, int], int] = {}
+        error = None
+        for key, delta in list(batch.items()):
+            if error is not None:  # the DB is unavailable, the rest is left for the next flush
+                retry[key] = delta
+                continue
+            chat_id = chats.get(key[0])
+            try:
+                await self._repository.add_goods_in_cart({key: delta}, {chat_id} if chat_id is not None else None)
+            except IntegrityError as e:
+                logger.error(f"Cart add of {delta} x (cart_id, good_id)={key} dropped: {e}")
+            except Exception as e:
+                error = e
+                retry[key] = delta
+                continue
+            self._in_flight.pop(key)  # written or dropped, readers must not count it twice
+        if error is None:
+            return
+        # Put deltas back so that the next flush retries them
+        for key, delta in retry.items():
+            self._pending[key] = self._pending.get(key, 0) + delta
+            if key[0] in chats:
+                self._pending_chats.setdefault(key[0], chats[key[0]])
+        self._pending_ops += sum(retry.values())
+        raise error
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Cart buffer flush failed: {e}")
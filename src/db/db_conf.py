@@ -1,13 +1,51 @@
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import DBAPIConnection
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 
 from src.db.models import Base
+from src.db.router import SessionRouter
 from src.settings import Settings
 
-engine = create_async_engine(
-    f"postgresql+asyncpg://{Settings.POSTGRES_USER}:{Settings.POSTGRES_PASSWORD}@{Settings.POSTGRES_HOST}:"
-    f"{Settings.POSTGRES_PORT}/{Settings.POSTGRES_DB}",
-)
+
+def _build_url(host: str, port: str) -> str:
+    return (
+        f"postgresql+asyncpg://{Settings.POSTGRES_USER}:{Settings.POSTGRES_PASSWORD}@{host}:"
+        f"{port}/{Settings.POSTGRES_DB}"
+    )
+
+
+def _read_url() -> str | None:
+    if Settings.READ_DATABASE_URL:
+        return Settings.READ_DATABASE_URL
+    if Settings.POSTGRES_REPLICA_HOST and not Settings.DATABASE_URL:
+        return _build_url(Settings.POSTGRES_REPLICA_HOST, Settings.POSTGRES_REPLICA_PORT)
+    return None
+
+
+def _enable_sqlite_foreign_keys(async_engine: AsyncEngine) -> None:
+    # SQLite ignores foreign keys unless enabled per connection, PostgreSQL always enforces them
+    if async_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def on_connect(dbapi_connection: DBAPIConnection, _: object) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+engine = create_async_engine(Settings.DATABASE_URL or _build_url(Settings.POSTGRES_HOST, Settings.POSTGRES_PORT))
+read_url = _read_url()
+read_engine = create_async_engine(read_url) if read_url else engine
+_enable_sqlite_foreign_keys(engine)
+if read_engine is not engine:
+    _enable_sqlite_foreign_keys(read_engine)
 DbSession = async_sessionmaker(engine, expire_on_commit=False)
+ReadDbSession = async_sessionmaker(read_engine, expire_on_commit=False)
+
+
+def build_session_router() -> SessionRouter:
+    return SessionRouter(DbSession, ReadDbSession, Settings.READ_YOUR_WRITES_WINDOW)
 
 
 async def init_orm() -> None:
@@ -17,3 +55,5 @@ async def init_orm() -> None:
 
 async def close_orm() -> None:
     await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
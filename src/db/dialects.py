@@ -0,0 +1,17 @@
+from sqlalchemy import Table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Both dialects provide INSERT ... ON CONFLICT with the same on_conflict_do_update() API
+_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def upsert(session: AsyncSession, table: Table) -> postgresql.Insert | sqlite.Insert:
+    dialect_name = session.get_bind().dialect.name
+    try:
+        return _INSERTS[dialect_name](table)
+    except KeyError:
+        raise NotImplementedError(f"Upserts are not supported for {dialect_name=}") from None
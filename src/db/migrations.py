@@ -0,0 +1,64 @@
+import logging
+
+from sqlalchemy import text
+
+from src.db.db_conf import engine
+
+logger = logging.getLogger(__name__)
+
+# Brings a PostgreSQL database created before shops, order items and cart timestamps up to the current models.
+# New tables are created by init_orm beforehand, these statements only alter existing ones and are safe to run again.
+# Existing rows are moved to the :shop shop. Old orders have no recorded items, so they are not in /stats.
+UPGRADE_STATEMENTS = [
+    "INSERT INTO shops (name) SELECT :shop WHERE NOT EXISTS (SELECT 1 FROM shops WHERE name = :shop)",
+    # users: scoped by shop, a Telegram user can be a customer of several shops
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS shop_id INTEGER REFERENCES shops (id)",
+    "UPDATE users SET shop_id = (SELECT id FROM shops WHERE name = :shop) WHERE shop_id IS NULL",
+    "ALTER TABLE users ALTER COLUMN shop_id SET NOT NULL",
+    "ALTER TABLE users DROP CONSTRAINT IF EXISTS users_chat_id_key",
+    "ALTER TABLE users DROP CONSTRAINT IF EXISTS users_phone_key",
+    "CREATE UNIQUE INDEX IF NOT EXISTS users_shop_id_chat_id_key ON users (shop_id, chat_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS users_shop_id_phone_key ON users (shop_id, phone)",
+    # categories
+    "ALTER TABLE categories ADD COLUMN IF NOT EXISTS shop_id INTEGER REFERENCES shops (id)",
+    "UPDATE categories SET shop_id = (SELECT id FROM shops WHERE name = :shop) WHERE shop_id IS NULL",
+    "ALTER TABLE categories ALTER COLUMN shop_id SET NOT NULL",
+    "ALTER TABLE categories DROP CONSTRAINT IF EXISTS categories_name_key",
+    "CREATE UNIQUE INDEX IF NOT EXISTS categories_shop_id_name_key ON categories (shop_id, name)",
+    # goods: shop and processed photo columns
+    "ALTER TABLE goods ADD COLUMN IF NOT EXISTS shop_id INTEGER REFERENCES shops (id)",
+    "UPDATE goods SET shop_id = (SELECT id FROM shops WHERE name = :shop) WHERE shop_id IS NULL",
+    "ALTER TABLE goods ALTER COLUMN shop_id SET NOT NULL",
+    "ALTER TABLE goods DROP CONSTRAINT IF EXISTS goods_name_key",
+    "CREATE UNIQUE INDEX IF NOT EXISTS goods_shop_id_name_key ON goods (shop_id, name)",
+    "ALTER TABLE goods ADD COLUMN IF NOT EXISTS photo_file_id VARCHAR(256)",
+    "ALTER TABLE goods ADD COLUMN IF NOT EXISTS photo_hash VARCHAR(64)",
+    "ALTER TABLE goods ADD COLUMN IF NOT EXISTS photo_processed_path VARCHAR(128)",
+    "ALTER TABLE goods ADD COLUMN IF NOT EXISTS photo_thumb_path VARCHAR(128)",
+    # carts: timestamps for abandoned cart reminders and retention
+    "ALTER TABLE carts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE",
+    "UPDATE carts SET updated_at = now() WHERE updated_at IS NULL",
+    "ALTER TABLE carts ALTER COLUMN updated_at SET NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_carts_updated_at ON carts (updated_at)",
+    "ALTER TABLE carts ADD COLUMN IF NOT EXISTS reminded_at TIMESTAMP WITH TIME ZONE",
+    # orders
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS shop_id INTEGER REFERENCES shops (id)",
+    "UPDATE orders SET shop_id = (SELECT id FROM shops WHERE name = :shop) WHERE shop_id IS NULL",
+    "ALTER TABLE orders ALTER COLUMN shop_id SET NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_orders_shop_id ON orders (shop_id)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_user_id_id_desc ON orders (user_id, id DESC)",
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE",
+    "UPDATE orders SET created_at = now() WHERE created_at IS NULL",
+    "ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL",
+]
+
+
+async def upgrade_schema(shop_name: str) -> None:
+    if engine.dialect.name != "postgresql":
+        # SQLite support came with these changes, so SQLite databases never had the old schema
+        logger.info(f"Nothing to upgrade for {engine.dialect.name}")
+        return
+    async with engine.begin() as conn:  # DDL is transactional in PostgreSQL: all or nothing
+        for statement in UPGRADE_STATEMENTS:
+            await conn.execute(text(statement), {"shop": shop_name} if ":shop" in statement else {})
+    logger.info(f"Schema upgraded, existing rows belong to shop {shop_name}")
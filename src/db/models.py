@@ -1,4 +1,5 @@
 import enum
+from datetime import datetime, timezone
 from decimal import Decimal
 from uuid import UUID, uuid4
 
@@ -6,14 +7,19 @@ from sqlalchemy import (
     Boolean,
     CheckConstraint,
     Column,
+    Date,
+    DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     Numeric,
     String,
     Table,
+    UniqueConstraint,
+    Uuid,
+    desc,
 )
-from sqlalchemy.dialects.postgresql import UUID as SQLUUID
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -27,12 +33,20 @@ class Base(DeclarativeBase, AsyncAttrs):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
 
+class Shop(Base):
+    __tablename__ = "shops"
+    name: Mapped[str] = mapped_column(String(128), unique=True)
+
+
+# Tenant-scoped tables carry shop_id, uniqueness is per shop since one Telegram user can use several bots
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (UniqueConstraint("shop_id", "chat_id"), UniqueConstraint("shop_id", "phone"))
 
-    chat_id: Mapped[int] = mapped_column(Integer, unique=True)
+    shop_id: Mapped[int] = mapped_column(Integer, ForeignKey("shops.id"))
+    chat_id: Mapped[int] = mapped_column(Integer)
     full_name: Mapped[str] = mapped_column(String(128), nullable=True)
-    phone: Mapped[str] = mapped_column(String(128), nullable=True, unique=True)
+    phone: Mapped[str] = mapped_column(String(128), nullable=True)
     adress: Mapped[str] = mapped_column(String(256), nullable=True)
     cart = relationship("Cart", back_populates="user")
     orders = relationship("Order", back_populates="user")
@@ -40,7 +54,9 @@ class User(Base):
 
 class Category(Base):
     __tablename__ = "categories"
-    name: Mapped[str] = mapped_column(String(128), unique=True)
+    __table_args__ = (UniqueConstraint("shop_id", "name"),)
+    shop_id: Mapped[int] = mapped_column(Integer, ForeignKey("shops.id"))
+    name: Mapped[str] = mapped_column(String(128))
     goods = relationship("Good", back_populates="category")
 
 
@@ -56,27 +72,74 @@ cart_good_table = Table(
 
 class Good(Base):
     __tablename__ = "goods"
-    name: Mapped[str] = mapped_column(String(128), unique=True)  # unique to simplify admin management
+    __table_args__ = (UniqueConstraint("shop_id", "name"),)  # unique to simplify admin management
+    shop_id: Mapped[int] = mapped_column(Integer, ForeignKey("shops.id"))
+    name: Mapped[str] = mapped_column(String(128))
     description: Mapped[str] = mapped_column(String(256))
     price: Mapped[Decimal] = mapped_column(Numeric(10, 2))
     photo_file_path: Mapped[str] = mapped_column(String(128), nullable=True)
+    photo_file_id: Mapped[str] = mapped_column(String(256), nullable=True)  # Telegram file_id, preferred over files
+    photo_hash: Mapped[str] = mapped_column(String(64), nullable=True)  # sha256 of the source photo
+    photo_processed_path: Mapped[str] = mapped_column(String(128), nullable=True)
+    photo_thumb_path: Mapped[str] = mapped_column(String(128), nullable=True)
     category_id: Mapped[int] = mapped_column(Integer, ForeignKey("categories.id"))
     category = relationship("Category", back_populates="goods")
     carts = relationship("Cart", secondary=cart_good_table, back_populates="goods")
 
 
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Cart(Base):
     __tablename__ = "carts"
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now, index=True)
+    reminded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
     user = relationship("User", back_populates="cart")
     goods = relationship("Good", secondary=cart_good_table, back_populates="carts")
 
 
 class Order(Base):
     __tablename__ = "orders"
-    number: Mapped[UUID] = mapped_column(SQLUUID(as_uuid=True), default=uuid4)
+    __table_args__ = (Index("ix_orders_user_id_id_desc", "user_id", desc("id")),)  # keyset pages of user orders
+    shop_id: Mapped[int] = mapped_column(Integer, ForeignKey("shops.id"), index=True)
+    number: Mapped[UUID] = mapped_column(Uuid(as_uuid=True), default=uuid4)
     is_approved: Mapped[bool] = mapped_column(Boolean, default=False)
     delivery_type: Mapped[DeliveryTypes] = mapped_column(Enum(DeliveryTypes))
     status: Mapped[str] = mapped_column(String(256), default="Created")
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
     user = relationship("User", back_populates="orders")
+
+
+order_good_table = Table(
+    "order_good",
+    Base.metadata,
+    Column("order_id", Integer, ForeignKey("orders.id"), primary_key=True),
+    Column("good_id", Integer, ForeignKey("goods.id"), primary_key=True),
+    Column("quantity", Integer),
+    Column("price", Numeric(10, 2)),  # price at the moment of order
+)
+
+
+# Sales aggregates, updated in the order creation transaction so /stats never scans orders
+daily_sales_table = Table(
+    "daily_sales",
+    Base.metadata,
+    Column("shop_id", Integer, ForeignKey("shops.id"), primary_key=True),
+    Column("day", Date, primary_key=True),
+    Column("orders_count", Integer, default=0),
+    Column("items_count", Integer, default=0),
+    Column("revenue", Numeric(12, 2), default=0),
+)
+
+
+good_daily_sales_table = Table(
+    "good_daily_sales",
+    Base.metadata,
+    Column("day", Date, primary_key=True),
+    Column("good_id", Integer, ForeignKey("goods.id"), primary_key=True),
+    Column("quantity", Integer, default=0),
+    Column("revenue", Numeric(12, 2), default=0),
+)
@@ -1,37 +1,82 @@
 import logging
+from datetime import date, datetime
+from decimal import Decimal
 
-from sqlalchemy import delete, insert, select, update
+from sqlalchemy import Row, delete, func, insert, or_, select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
 
 from src.bot.exceptions import UserDoesNotExist
+from src.db.dialects import upsert
 from src.db.models import (
     Cart,
     Category,
     DeliveryTypes,
     Good,
     Order,
+    Shop,
     User,
     cart_good_table,
+    daily_sales_table,
+    good_daily_sales_table,
+    order_good_table,
+    utc_now,
 )
+from src.db.router import SessionRouter
+from src.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
 
+class ShopRepository:
+    def __init__(self, router: SessionRouter) -> None:
+        self._router = router
+
+    async def get_or_create_shop_id(self, name: str) -> int:
+        async with self._router.writer() as session:
+            res = await session.execute(select(Shop.id).where(Shop.name == name))
+            shop_id = res.scalar_one_or_none()
+            if shop_id is None:
+                shop = Shop(name=name)
+                session.add(shop)
+                await session.commit()
+                shop_id = shop.id
+                logger.info(f"Shop {name=} created with {shop_id=}")
+            return shop_id
+
+
+# One instance per shop, every tenant-scoped query is filtered by its shop_id
+@tracer.trace_methods("db")
 class Repository:
-    def __init__(self, session: AsyncSession) -> None:
-        self._session = session
+    def __init__(self, router: SessionRouter, shop_id: int) -> None:
+        self._router = router
+        self._shop_id = shop_id
 
-    async def get_all_categories_goods(self) -> list[Category]:
-        async with self._session as session:
-            res = await session.execute(select(Category).options(joinedload(Category.goods)))
-            res = res.unique()
-            return res.scalars().all()
+    async def get_all_categories_goods(self, primary: bool = False) -> list[Row]:
+        async with self._router.primary() if primary else self._router.reader() as session:
+            stmt = (
+                select(
+                    Category.id,
+                    Category.name,
+                    Good.id,
+                    Good.name,
+                    Good.description,
+                    Good.price,
+                    Good.photo_file_path,
+                    Good.photo_processed_path,
+                    Good.photo_thumb_path,
+                    Good.photo_file_id,
+                )
+                .outerjoin(Good, Good.category_id == Category.id)
+                .where(Category.shop_id == self._shop_id)
+                .order_by(Category.id, Good.id)
+            )
+            res = await session.execute(stmt)
+            return res.all()
 
     async def create_cart_user(self, chat_id: int) -> None:
-        async with self._session as session:
-            user = User(chat_id=chat_id)
+        async with self._router.writer() as session:
+            user = User(shop_id=self._shop_id, chat_id=chat_id)
             session.add(user)
             await session.commit()
             await session.refresh(user)
@@ -40,8 +85,8 @@ class Repository:
             await session.commit()
 
     async def get_user_by_chat_id(self, chat_id: int) -> User | None:
-        async with self._session as session:
-            stmt = select(User).filter_by(chat_id=chat_id)
+        async with self._router.reader() as session:
+            stmt = select(User).filter_by(shop_id=self._shop_id, chat_id=chat_id)
             res = await session.execute(stmt)
             res = res.scalar_one_or_none()
 
@@ -50,60 +95,71 @@ class Repository:
                 raise UserDoesNotExist()
             return res
 
-    async def get_cart_by_user_id(self, user_id: int) -> Cart | None:
-        async with self._session as session:
-            stmt = select(Cart).filter_by(user_id=user_id).options(joinedload(Cart.goods))
+    async def get_user_cart_ids(self, chat_id: int) -> Row:
+        async with self._router.reader() as session:
+            stmt = (
+                select(User.id, Cart.id)
+                .join(Cart, Cart.user_id == User.id)
+                .where(User.shop_id == self._shop_id, User.chat_id == chat_id)
+            )
             res = await session.execute(stmt)
-            res = res.unique()
-            return res.scalar_one_or_none()
+            row = res.first()
 
-    async def add_good_in_cart(self, cart_id: int, good_id: int) -> None:
-        async with self._session as session:
-            async with session.begin():
-                stmt = (
-                    select(cart_good_table)
-                    .where(
-                        cart_good_table.c.cart_id == cart_id,
-                        cart_good_table.c.good_id == good_id,
-                    )
-                    .with_for_update()
-                )
-                res = await session.execute(stmt)
-                row = res.first()
-
-                if row:
-                    stmt = (
-                        update(cart_good_table)
-                        .where(
-                            cart_good_table.c.cart_id == cart_id,
-                            cart_good_table.c.good_id == good_id,
-                        )
-                        .values(quantity=row.quantity + 1)
-                    )
-                    log_msg = f"{good_id=} in {cart_id} increased by one"
-                else:
-                    stmt = insert(cart_good_table).values(cart_id=cart_id, good_id=good_id)
-                    log_msg = f"{good_id=} added in cart {cart_id=}"
+            if not row:
+                logger.info(f" User with {chat_id=} doesn't exist")
+                raise UserDoesNotExist()
+            return row
 
-                await session.execute(stmt)
-                await session.commit()
-                logger.info(log_msg)
+    async def get_recent_users_cart_ids(self, limit: int) -> list[Row]:
+        async with self._router.reader() as session:
+            stmt = (
+                select(User.chat_id, User.id, Cart.id)
+                .join(Cart, Cart.user_id == User.id)
+                .where(User.shop_id == self._shop_id)
+                .order_by(User.id.desc())
+                .limit(limit)
+            )
+            res = await session.execute(stmt)
+            return res.all()
 
-    async def get_good_quantity(self, cart_id: int) -> dict[int, int]:
-        async with self._session as session:
-            stmt = select(cart_good_table).where(
-                cart_good_table.c.cart_id == cart_id,
+    async def get_cart_goods(self, cart_id: int) -> list[Row]:
+        async with self._router.reader() as session:
+            stmt = (
+                select(Good.id, Good.name, Good.price, cart_good_table.c.quantity)
+                .join(cart_good_table, cart_good_table.c.good_id == Good.id)
+                .where(cart_good_table.c.cart_id == cart_id)
+                .order_by(Good.id)
             )
             res = await session.execute(stmt)
-            row = res.all()
+            return res.all()
 
-            if not row:
-                return {}
+    async def add_good_in_cart(self, cart_id: int, good_id: int) -> None:
+        await self.add_goods_in_cart({(cart_id, good_id): 1})
+        logger.info(f"{good_id=} added in cart {cart_id=}")
 
-            return {r.good_id: r.quantity for r in row}
+    async def add_goods_in_cart(self, deltas: dict[tuple[int, int], int], chat_ids: set[int] | None = None) -> None:
+        async with self._router.writer() as session:
+            stmt = upsert(session, cart_good_table).values(
+                [
+                    {"cart_id": cart_id, "good_id": good_id, "quantity": delta}
+                    for (cart_id, good_id), delta in deltas.items()
+                ]
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cart_good_table.c.cart_id, cart_good_table.c.good_id],
+                set_={"quantity": cart_good_table.c.quantity + stmt.excluded.quantity},
+            )
+            await session.execute(stmt)
+            await self._touch_carts(session, {cart_id for cart_id, _ in deltas})
+            await session.commit()
+        if chat_ids:
+            self._router.mark_writes(chat_ids)
+
+    async def _touch_carts(self, session: AsyncSession, cart_ids: set[int]) -> None:
+        await session.execute(update(Cart).where(Cart.id.in_(cart_ids)).values(updated_at=utc_now()))
 
     async def change_good_quantity(self, cart_id: int, good_id: int, new_quantity: int) -> None:
-        async with self._session as session:
+        async with self._router.writer() as session:
             try:
                 stmt = (
                     update(cart_good_table)
@@ -114,6 +170,7 @@ class Repository:
                     .values(quantity=new_quantity)
                 )
                 await session.execute(stmt)
+                await self._touch_carts(session, {cart_id})
                 await session.commit()
             except IntegrityError as e:
                 await session.rollback()
@@ -121,67 +178,276 @@ class Repository:
                 logger.info(f"{e}, {good_id=} deleted")
 
     async def delete_good_from_cart(self, cart_id: int, good_id: int) -> None:
-        async with self._session as session:
+        async with self._router.writer() as session:
             stmt = delete(cart_good_table).where(
                 cart_good_table.c.cart_id == cart_id,
                 cart_good_table.c.good_id == good_id,
             )
             await session.execute(stmt)
+            await self._touch_carts(session, {cart_id})
+            await session.commit()
+
+    async def pop_abandoned_carts(self, updated_before: datetime, limit: int) -> list[int]:
+        # Selected and marked in one transaction on the primary: a lagging replica would return the same carts again
+        async with self._router.primary() as session:
+            has_goods = select(cart_good_table.c.cart_id).where(cart_good_table.c.cart_id == Cart.id).exists()
+            candidates = (
+                select(Cart.id)
+                .join(User, User.id == Cart.user_id)
+                .where(
+                    User.shop_id == self._shop_id,
+                    Cart.updated_at < updated_before,
+                    or_(Cart.reminded_at.is_(None), Cart.reminded_at < Cart.updated_at),
+                    has_goods,
+                )
+                .order_by(Cart.updated_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True, of=Cart)  # concurrent nodes skip carts being reminded
+            )
+            stmt = (
+                update(Cart)
+                .where(Cart.id.in_(candidates.scalar_subquery()))
+                .values(reminded_at=utc_now())
+                .returning(Cart.user_id)
+            )
+            res = await session.execute(stmt)
+            user_ids = res.scalars().all()
+            chat_ids = []
+            if user_ids:
+                res = await session.execute(select(User.chat_id).where(User.id.in_(user_ids)))
+                chat_ids = res.scalars().all()
             await session.commit()
+            return chat_ids
+
+    async def purge_expired_carts(self, updated_before: datetime, chunk_size: int) -> int:
+        deleted = 0
+        while True:
+            # Short transaction per chunk, so cart_good is never locked for long
+            async with self._router.writer() as session:
+                chunk = (
+                    select(cart_good_table.c.cart_id)
+                    .join(Cart, Cart.id == cart_good_table.c.cart_id)
+                    .join(User, User.id == Cart.user_id)
+                    .where(User.shop_id == self._shop_id, Cart.updated_at < updated_before)
+                    .distinct()
+                    .limit(chunk_size)
+                    .scalar_subquery()
+                )
+                res = await session.execute(delete(cart_good_table).where(cart_good_table.c.cart_id.in_(chunk)))
+                await session.commit()
+            if not res.rowcount:
+                return deleted
+            deleted += res.rowcount
 
     async def add_user_contacts(self, user_id: int, full_name: str, phone: str, adress: str) -> None:
-        async with self._session as session:
+        async with self._router.writer() as session:
             stmt = update(User).where(User.id == user_id).values(full_name=full_name, phone=phone, adress=adress)
             await session.execute(stmt)
             await session.commit()
 
-    async def create_order(self, user_id: int, delivery_type: DeliveryTypes) -> Order:
-        async with self._session as session:
-            order = Order(user_id=user_id, delivery_type=delivery_type)
+    async def create_order(self, user_id: int, cart_id: int, delivery_type: DeliveryTypes) -> Order:
+        async with self._router.writer() as session:
+            stmt = (
+                select(cart_good_table.c.good_id, cart_good_table.c.quantity, Good.price)
+                .join(Good, Good.id == cart_good_table.c.good_id)
+                .where(cart_good_table.c.cart_id == cart_id)
+                .with_for_update(of=cart_good_table)  # goods rows stay unlocked for other checkouts and edits
+            )
+            res = await session.execute(stmt)
+            items = res.all()
+            order = Order(shop_id=self._shop_id, user_id=user_id, delivery_type=delivery_type)
             session.add(order)
+            await session.flush()
+            if items:
+                await session.execute(
+                    insert(order_good_table),
+                    [
+                        {"order_id": order.id, "good_id": good_id, "quantity": quantity, "price": price}
+                        for good_id, quantity, price in items
+                    ],
+                )
+                await session.execute(delete(cart_good_table).where(cart_good_table.c.cart_id == cart_id))
             await session.commit()
             await session.refresh(order)
-            return order
+        if items:
+            await self._add_order_to_sales(order, items)
+        return order
+
+    async def _add_order_to_sales(self, order: Order, items: list[Row]) -> None:
+        # Separate short transaction: every checkout of a shop updates the same daily row, holding its lock
+        # for the whole checkout would serialize them. An order committed without stats is only logged.
+        try:
+            async with self._router.writer() as session:
+                await self._upsert_sales(session, order.created_at.date(), items)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Order {order.id} not added to sales stats: {e}")
+
+    async def _upsert_sales(self, session: AsyncSession, day: date, items: list[Row]) -> None:
+        stmt = upsert(session, daily_sales_table).values(
+            shop_id=self._shop_id,
+            day=day,
+            orders_count=1,
+            items_count=sum(quantity for _, quantity, _ in items),
+            revenue=sum((quantity * price for _, quantity, price in items), Decimal(0)),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[daily_sales_table.c.shop_id, daily_sales_table.c.day],
+            set_={
+                "orders_count": daily_sales_table.c.orders_count + stmt.excluded.orders_count,
+                "items_count": daily_sales_table.c.items_count + stmt.excluded.items_count,
+                "revenue": daily_sales_table.c.revenue + stmt.excluded.revenue,
+            },
+        )
+        await session.execute(stmt)
+        stmt = upsert(session, good_daily_sales_table).values(
+            [
+                {"day": day, "good_id": good_id, "quantity": quantity, "revenue": quantity * price}
+                for good_id, quantity, price in items
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[good_daily_sales_table.c.day, good_daily_sales_table.c.good_id],
+            set_={
+                "quantity": good_daily_sales_table.c.quantity + stmt.excluded.quantity,
+                "revenue": good_daily_sales_table.c.revenue + stmt.excluded.revenue,
+            },
+        )
+        await session.execute(stmt)
+
+    async def get_daily_sales(self, since: date) -> list[Row]:
+        async with self._router.reader() as session:
+            stmt = (
+                select(
+                    daily_sales_table.c.day,
+                    daily_sales_table.c.orders_count,
+                    daily_sales_table.c.items_count,
+                    daily_sales_table.c.revenue,
+                )
+                .where(daily_sales_table.c.shop_id == self._shop_id, daily_sales_table.c.day >= since)
+                .order_by(daily_sales_table.c.day)
+            )
+            res = await session.execute(stmt)
+            return res.all()
+
+    async def get_top_goods(self, since: date, limit: int) -> list[Row]:
+        async with self._router.reader() as session:
+            revenue = func.sum(good_daily_sales_table.c.revenue)
+            stmt = (
+                select(Good.name, func.sum(good_daily_sales_table.c.quantity), revenue)
+                .join(Good, Good.id == good_daily_sales_table.c.good_id)
+                .where(Good.shop_id == self._shop_id, good_daily_sales_table.c.day >= since)
+                .group_by(Good.id, Good.name)
+                .order_by(revenue.desc())
+                .limit(limit)
+            )
+            res = await session.execute(stmt)
+            return res.all()
 
     async def change_order_approvement(self, order_id: int, new_status: bool) -> None:
-        async with self._session as session:
-            stmt = update(Order).where(Order.id == order_id).values(is_approved=new_status)
+        async with self._router.writer() as session:
+            stmt = (
+                update(Order).where(Order.shop_id == self._shop_id, Order.id == order_id).values(is_approved=new_status)
+            )
             await session.execute(stmt)
             await session.commit()
 
-    async def show_orders(self) -> list[Order]:
-        async with self._session as session:
-            res = await session.execute(select(Order))
-            return res.scalars().all()
+    async def show_orders(self) -> list[Row]:
+        async with self._router.reader() as session:
+            stmt = select(
+                Order.id,
+                Order.number,
+                Order.is_approved,
+                Order.delivery_type,
+                Order.status,
+                Order.user_id,
+            )
+            stmt = stmt.where(Order.shop_id == self._shop_id).order_by(Order.id)
+            res = await session.execute(stmt)
+            return res.all()
+
+    async def get_user_orders(
+        self, user_id: int, before_id: int | None, limit: int, primary: bool = False
+    ) -> list[Row]:
+        async with self._router.primary() if primary else self._router.reader() as session:
+            stmt = select(Order.id, Order.number, Order.delivery_type, Order.status, Order.created_at).where(
+                Order.shop_id == self._shop_id, Order.user_id == user_id
+            )
+            if before_id is not None:
+                stmt = stmt.where(Order.id < before_id)
+            res = await session.execute(stmt.order_by(Order.id.desc()).limit(limit))
+            return res.all()
+
+    async def get_orders_goods(self, order_ids: list[int]) -> list[Row]:
+        async with self._router.reader() as session:
+            stmt = (
+                select(order_good_table.c.order_id, Good.name, order_good_table.c.quantity, order_good_table.c.price)
+                .join(Good, Good.id == order_good_table.c.good_id)
+                .where(order_good_table.c.order_id.in_(order_ids))
+                .order_by(order_good_table.c.order_id, Good.id)
+            )
+            res = await session.execute(stmt)
+            return res.all()
 
     async def change_order_status(self, order_id: int, new_status: str) -> None:
-        async with self._session as session:
-            order = await session.get(Order, order_id)
-            if not order:
+        async with self._router.writer() as session:
+            stmt = (
+                update(Order)
+                .where(Order.shop_id == self._shop_id, Order.id == order_id)
+                .values(status=new_status)
+                .returning(Order.id)
+            )
+            res = await session.execute(stmt)
+            if res.scalar_one_or_none() is None:
                 raise ValueError(f"{order_id=} not found")
-            stmt = update(Order).where(Order.id == order_id).values(status=new_status)
-            await session.execute(stmt)
             await session.commit()
 
     async def add_good(self, validated_data: dict) -> None:
-        async with self._session as session:
-            good = Good(**validated_data)
+        async with self._router.writer() as session:
+            good = Good(shop_id=self._shop_id, **validated_data)
             session.add(good)
             await session.commit()
 
     async def update_good(self, good_name: str, values: dict) -> None:
-        async with self._session as session:
-            stmt = select(Good).where(Good.name == good_name).with_for_update()
+        async with self._router.writer() as session:
+            stmt = select(Good).where(Good.shop_id == self._shop_id, Good.name == good_name).with_for_update()
             res = await session.execute(stmt)
             if not res.scalar_one_or_none():
                 raise ValueError(f"{good_name=} not found")
-            stmt = update(Good).where(Good.name == good_name).values(**values)
+            stmt = update(Good).where(Good.shop_id == self._shop_id, Good.name == good_name).values(**values)
             await session.execute(stmt)
             await session.commit()
 
+    async def update_good_photo(self, good_name: str, values: dict) -> int:
+        async with self._router.writer() as session:
+            stmt = (
+                update(Good)
+                .where(Good.shop_id == self._shop_id, Good.name == good_name)
+                .values(**values)
+                .returning(Good.id)
+            )
+            res = await session.execute(stmt)
+            good_id = res.scalar_one_or_none()
+            if good_id is None:
+                raise ValueError(f"{good_name=} not found")
+            await session.commit()
+            return good_id
+
+    async def set_photo_file_id(self, good_id: int, file_id: str) -> None:
+        async with self._router.writer() as session:
+            stmt = update(Good).where(Good.shop_id == self._shop_id, Good.id == good_id).values(photo_file_id=file_id)
+            await session.execute(stmt)
+            await session.commit()
+
+    async def get_good_id_by_name(self, good_name: str) -> int | None:
+        async with self._router.reader() as session:
+            stmt = select(Good.id).where(Good.shop_id == self._shop_id, Good.name == good_name)
+            res = await session.execute(stmt)
+            return res.scalar_one_or_none()
+
     async def get_category_id_by_name(self, category_name: str) -> int:
-        async with self._session as session:
-            stmt = select(Category).where(Category.name == category_name)
+        async with self._router.reader() as session:
+            stmt = select(Category).where(Category.shop_id == self._shop_id, Category.name == category_name)
             res = await session.execute(stmt)
             res = res.scalar_one_or_none()
             if not res:
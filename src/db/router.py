@@ -0,0 +1,60 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+current_chat_id: ContextVar[int | None] = ContextVar("current_chat_id", default=None)
+
+PRUNE_THRESHOLD = 10_000
+
+
+class SessionRouter:
+    def __init__(
+        self,
+        write_sessionmaker: async_sessionmaker[AsyncSession],
+        read_sessionmaker: async_sessionmaker[AsyncSession],
+        read_your_writes_window: float,
+    ) -> None:
+        self._write_sessionmaker = write_sessionmaker
+        self._read_sessionmaker = read_sessionmaker
+        self._window = read_your_writes_window
+        self._last_writes: dict[int, float] = {}
+
+    def reader(self) -> AsyncSession:
+        chat_id = current_chat_id.get()
+        if chat_id is not None and self._wrote_recently(chat_id):
+            return self._write_sessionmaker()
+        return self._read_sessionmaker()
+
+    def primary(self) -> AsyncSession:
+        # Reads that must see the latest writes regardless of the chat, without marking a write
+        return self._write_sessionmaker()
+
+    def writer(self) -> AsyncSession:
+        chat_id = current_chat_id.get()
+        if chat_id is not None:
+            self._mark_write(chat_id)
+        return self._write_sessionmaker()
+
+    def mark_writes(self, chat_ids: set[int]) -> None:
+        # For writes made outside of the chat's context, e.g. by a background flush
+        for chat_id in chat_ids:
+            self._mark_write(chat_id)
+
+    def _wrote_recently(self, chat_id: int) -> bool:
+        written_at = self._last_writes.get(chat_id)
+        return written_at is not None and time.monotonic() - written_at < self._window
+
+    def _mark_write(self, chat_id: int) -> None:
+        now = time.monotonic()
+        self._last_writes[chat_id] = now
+        if len(self._last_writes) > PRUNE_THRESHOLD:
+            self._last_writes = {
+                chat_id: written_at
+                for chat_id, written_at in self._last_writes.items()
+                if now - written_at < self._window
+            }
+            logger.info(f"Read-your-writes marks pruned to {len(self._last_writes)}")
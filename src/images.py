@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from src.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Settings.BASE_DIR
+PHOTO_MAX_SIDE = 1280  # Telegram downscales larger photos anyway
+THUMB_MAX_SIDE = 320
+JPEG_QUALITY = 85
+
+
+@dataclass(frozen=True, slots=True)
+class ProcessedImage:
+    content_hash: str
+    photo_path: str
+    thumb_path: str
+
+
+def _save_jpeg(image: Image.Image, max_side: int, path: Path) -> None:
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    # Written aside and renamed, so a killed or concurrent save never leaves a truncated file at the final path,
+    # which would then be treated as processed
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # No exif/icc passed to save(), so metadata is stripped
+            image.save(f, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _derived_paths(content_hash: str, output_dir: str) -> tuple[Path, Path]:
+    output = BASE_DIR / output_dir
+    return output / f"{content_hash[:16]}.jpg", output / f"{content_hash[:16]}_thumb.jpg"
+
+
+def _to_stored_path(path: Path) -> str:
+    # Paths inside the project are stored relative to it, like Good.photo_file_path
+    return str(path.relative_to(BASE_DIR)) if path.is_relative_to(BASE_DIR) else str(path)
+
+
+def process_image(source: bytes, output_dir: str) -> ProcessedImage:
+    content_hash = hashlib.sha256(source).hexdigest()
+    photo_path, thumb_path = _derived_paths(content_hash, output_dir)
+    if not (photo_path.exists() and thumb_path.exists()):
+        photo_path.parent.mkdir(parents=True, exist_ok=True)
+        with Image.open(BytesIO(source)) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            _save_jpeg(image, PHOTO_MAX_SIDE, photo_path)
+            _save_jpeg(image, THUMB_MAX_SIDE, thumb_path)
+    return ProcessedImage(
+        content_hash=content_hash,
+        photo_path=_to_stored_path(photo_path),
+        thumb_path=_to_stored_path(thumb_path),
+    )
+
+
+def process_image_file(relative_path: str, output_dir: str, known_hash: str | None) -> ProcessedImage | None:
+    source = (BASE_DIR / relative_path).read_bytes()
+    if hashlib.sha256(source).hexdigest() == known_hash and all(
+        path.exists() for path in _derived_paths(known_hash, output_dir)
+    ):
+        return None
+    return process_image(source, output_dir)
+
+
+class ImageProcessor:
+    def __init__(self, output_dir: str, max_workers: int) -> None:
+        self._output_dir = output_dir
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    async def process(self, source: bytes) -> ProcessedImage:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, process_image, source, self._output_dir)
+
+    async def process_file(self, relative_path: str, known_hash: str | None = None) -> ProcessedImage | None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, process_image_file, relative_path, self._output_dir, known_hash
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
@@ -1,28 +1,195 @@
 import asyncio
 import logging
+import signal
+import time
+from contextlib import suppress
+from datetime import timedelta
 
 from aiogram import Bot, Dispatcher
 
-from src.bot.bot import ShopBot
+from src.bot.bot import ShopBot, TextConstants
+from src.bot.inline import InlineCatalog
+from src.bot.jobs import AbandonedCartJob
+from src.bot.render import RenderCache
+from src.bot.sender import ThrottledSender
 from src.bot.service import Service
-from src.db.db_conf import DbSession, init_orm
-from src.db.repository import Repository
+from src.db.cart_buffer import CartWriteBuffer
+from src.db.db_conf import build_session_router, close_orm, init_orm
+from src.db.repository import Repository, ShopRepository
+from src.db.router import SessionRouter
+from src.images import ImageProcessor
 from src.settings import Settings
+from src.shops import ShopConfig, load_shop_configs, split_budget
+from src.tracing import LoopLagMonitor, tracer
 
 logger = logging.getLogger(__name__)
 
 
-async def main() -> None:
-    logging.basicConfig(level=logging.INFO)
-    bot_obj = Bot(token=Settings.TOKEN)
-    dp = Dispatcher()
-    session = DbSession()
-    repo = Repository(session)
-    service = Service(repo)
-    shop_bot = ShopBot(dp, bot_obj, service, Settings.ADMIN_TOKEN)
+async def warm_up(name: str, service: Service, inline_catalog: InlineCatalog, users_count: int) -> None:
+    started = time.perf_counter()
+    try:
+        await service.warm_up(users_count)
+        await inline_catalog.get_results("")
+    except Exception as e:
+        logger.error(f"Warm up of shop {name} failed: {e}")
+        return
+    logger.info(f"Warm up of shop {name} finished in {time.perf_counter() - started:.3f}s")
+
+
+class ShopRuntime:
+    # Everything one shop needs on top of the engine, image pool and loop monitor shared by all shops
+    def __init__(
+        self,
+        config: ShopConfig,
+        bot_obj: Bot,
+        shop_id: int,
+        router: SessionRouter,
+        image_processor: ImageProcessor,
+        shops_count: int,
+    ) -> None:
+        self.name = config.name
+        repo = Repository(router, shop_id)
+        self._cart_buffer = None
+        if Settings.CART_WRITE_BEHIND:
+            self._cart_buffer = CartWriteBuffer(
+                repo, Settings.CART_FLUSH_INTERVAL_MS / 1000, Settings.CART_FLUSH_MAX_PENDING
+            )
+        self._service = Service(
+            repo,
+            self._cart_buffer,
+            split_budget(Settings.USER_CACHE_SIZE, shops_count),
+            split_budget(Settings.ORDER_VIEW_CACHE_SIZE, shops_count),
+            Settings.CATALOG_TTL,
+            Settings.ORDER_VIEW_TTL,
+        )
+        self._inline_catalog = InlineCatalog(
+            self._service,
+            TextConstants.ADD_TO_CART.value,
+            split_budget(Settings.INLINE_CACHE_SIZE, shops_count),
+            Settings.INLINE_CACHE_TIME,
+            Settings.PHOTOS_BASE_URL,
+        )
+        render_cache = RenderCache(split_budget(Settings.RENDER_CACHE_SIZE, shops_count))
+        self.shop_bot = ShopBot(
+            Dispatcher(),
+            bot_obj,
+            self._service,
+            self._inline_catalog,
+            render_cache,
+            image_processor,
+            config.admin_token,
+        )
+        self._sender = ThrottledSender(bot_obj, Settings.SENDER_RATE, Settings.REMINDER_BATCH_SIZE)
+        self._abandoned_cart_job = AbandonedCartJob(
+            self._service,
+            self._sender,
+            Settings.ABANDONED_CHECK_INTERVAL,
+            timedelta(hours=Settings.ABANDONED_CART_HOURS),
+            timedelta(days=Settings.CART_RETENTION_DAYS),
+            Settings.REMINDER_BATCH_SIZE,
+            Settings.PURGE_CHUNK_SIZE,
+        )
+        self._warm_up_users = split_budget(Settings.WARM_UP_USERS, shops_count)
+        self._warm_up_task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._cart_buffer:
+            self._cart_buffer.start()
+        self._warm_up_task = asyncio.create_task(
+            warm_up(self.name, self._service, self._inline_catalog, self._warm_up_users)
+        )
+        self._sender.start()
+        self._abandoned_cart_job.start()
+
+    async def close(self) -> None:
+        await self.shop_bot.drain(Settings.SHUTDOWN_TIMEOUT)
+        if self._warm_up_task:
+            self._warm_up_task.cancel()
+        await self._abandoned_cart_job.close()
+        await self._sender.close(Settings.SHUTDOWN_TIMEOUT)
+        if self._cart_buffer:
+            await self._cart_buffer.close()
+        await self.shop_bot.close()
+
+
+async def supervise_polling(shop: ShopRuntime, stop_requested: asyncio.Event, retry_delay: float) -> None:
+    # A shop whose polling fails (e.g. a revoked token) is retried on its own, the other shops keep running
+    while not stop_requested.is_set():
+        try:
+            await shop.shop_bot.start()
+        except Exception as e:
+            logger.error(f"Polling of shop {shop.name} failed: {e}")
+        else:
+            if stop_requested.is_set():
+                return
+            logger.warning(f"Polling of shop {shop.name} ended unexpectedly")
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop_requested.wait(), retry_delay)
+        if not stop_requested.is_set():
+            logger.info(f"Restarting polling of shop {shop.name}")
+
+
+async def run_until_stopped(shops: list[ShopRuntime]) -> None:
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    with suppress(NotImplementedError):  # signal handlers are not supported on Windows
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop_requested.set)
+    polling = [
+        asyncio.create_task(supervise_polling(shop, stop_requested, Settings.POLLING_RETRY_DELAY)) for shop in shops
+    ]
+    await stop_requested.wait()
+    logger.info("Stopping polling")
+    await asyncio.gather(*(shop.shop_bot.stop() for shop in shops))
+    await asyncio.gather(*polling)
+
+
+async def init_shops(router: SessionRouter, configs: list[ShopConfig]) -> list[int]:
     await init_orm()
     logger.info("DB initialized")
-    await shop_bot.start()
+    shop_repository = ShopRepository(router)
+    return [await shop_repository.get_or_create_shop_id(config.name) for config in configs]
+
+
+async def main() -> None:
+    started = time.perf_counter()
+    logging.basicConfig(level=logging.INFO)
+    configs = load_shop_configs()
+    if not configs:
+        raise ValueError("No shops configured, set TOKEN or SHOPS_FILE")
+    router = build_session_router()
+    bots = [Bot(token=config.token) for config in configs]
+    # Bot commands are set over the network while the DB is prepared
+    shop_ids, *_ = await asyncio.gather(
+        init_shops(router, configs), *(ShopBot.set_commands(bot_obj) for bot_obj in bots)
+    )
+    image_processor = ImageProcessor(Settings.PHOTOS_DIR, Settings.IMAGE_WORKERS)
+    shops = [
+        ShopRuntime(config, bot_obj, shop_id, router, image_processor, len(configs))
+        for config, bot_obj, shop_id in zip(configs, bots, shop_ids)
+    ]
+    for shop in shops:
+        shop.shop_bot.setup()
+        shop.start()
+    lag_monitor = None
+    if tracer.enabled:
+        lag_monitor = LoopLagMonitor(tracer, Settings.LOOP_LAG_INTERVAL, Settings.LOOP_LAG_THRESHOLD_MS / 1000)
+        lag_monitor.start()
+
+    logger.info(f"Startup of {len(shops)} shops took {time.perf_counter() - started:.3f}s")
+    try:
+        await run_until_stopped(shops)
+    finally:
+        # In-flight updates of every shop are drained before the shared engine and pool go away
+        results = await asyncio.gather(*(shop.close() for shop in shops), return_exceptions=True)
+        for shop, result in zip(shops, results):
+            if isinstance(result, Exception):
+                logger.error(f"Shop {shop.name} did not close cleanly: {result}")
+        if lag_monitor:
+            await lag_monitor.close()
+        await close_orm()
+        await asyncio.to_thread(image_processor.close)
+        logger.info("Shutdown complete")
 
 
 if __name__ == "__main__":
@@ -1,34 +1,90 @@
+import argparse
 import asyncio
 import json
+import logging
 
-from sqlalchemy import insert, select
+from sqlalchemy import insert, select, update
 
-from src.db.db_conf import DbSession
+from src.db.db_conf import DbSession, build_session_router, close_orm, init_orm
+from src.db.migrations import upgrade_schema
 from src.db.models import Category, Good
+from src.db.repository import ShopRepository
+from src.images import ImageProcessor
+from src.settings import Settings
 
 PATH = "data/initial_data.json"
 
+logger = logging.getLogger(__name__)
 
-async def load_initial_data(file_path: str) -> None:
+
+async def load_initial_data(file_path: str, shop_name: str) -> None:
     with open(file_path, "r", encoding="utf-8") as f:
         data = json.load(f)
-    category_data = data["categories"]
+    shop_id = await ShopRepository(build_session_router()).get_or_create_shop_id(shop_name)
+    category_data = [{**category, "shop_id": shop_id} for category in data["categories"]]
     good_data = data["goods"]
     async with DbSession() as session:
         await session.execute(insert(Category), category_data)
         await session.commit()
         for good in good_data:
-            stmt = select(Category).filter_by(name=good["category_name"])
+            stmt = select(Category).filter_by(shop_id=shop_id, name=good["category_name"])
             res = await session.execute(stmt)
             obj = res.scalar_one_or_none()
             good.pop("category_name")
             good["category_id"] = obj.id
+            good["shop_id"] = shop_id
         await session.execute(insert(Good), good_data)
         await session.commit()
 
 
+async def process_photos(processor: ImageProcessor) -> None:
+    async with DbSession() as session:
+        stmt = select(Good.id, Good.photo_file_path, Good.photo_hash).where(Good.photo_file_path.is_not(None))
+        res = await session.execute(stmt)
+        goods = res.all()
+        results = await asyncio.gather(
+            *(processor.process_file(photo_file_path, photo_hash) for _, photo_file_path, photo_hash in goods),
+            return_exceptions=True,
+        )
+        for (good_id, photo_file_path, _), result in zip(goods, results):
+            if isinstance(result, Exception):
+                logger.error(f"{photo_file_path=} of {good_id=} not processed: {result}")
+                continue
+            if result is None:
+                logger.info(f"{photo_file_path=} unchanged, skipped")
+                continue
+            stmt = (
+                update(Good)
+                .where(Good.id == good_id)
+                .values(
+                    photo_hash=result.content_hash,
+                    photo_processed_path=result.photo_path,
+                    photo_thumb_path=result.thumb_path,
+                )
+            )
+            await session.execute(stmt)
+            logger.info(f"{photo_file_path=} processed into {result.photo_path}")
+        await session.commit()
+
+
 async def main() -> None:
-    await load_initial_data(PATH)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", choices=["load_data", "process_photos", "migrate"], default="load_data")
+    parser.add_argument("--shop", default=Settings.DEFAULT_SHOP_NAME, help="shop to load data or move old rows into")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    await init_orm()
+    if args.command == "migrate":
+        await upgrade_schema(args.shop)
+    elif args.command == "load_data":
+        await load_initial_data(PATH, args.shop)
+    else:
+        processor = ImageProcessor(Settings.PHOTOS_DIR, Settings.IMAGE_WORKERS)
+        try:
+            await process_photos(processor)
+        finally:
+            processor.close()
+    await close_orm()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 
 from dotenv import load_dotenv
 
@@ -6,11 +7,57 @@ load_dotenv()
 
 
 class Settings:
+    BASE_DIR = Path(__file__).parent.parent  # Be carefull if reorgonised project
+
+    # Full SQLAlchemy URLs override POSTGRES_*, e.g. sqlite+aiosqlite:///shop.db for tests and benchmarks
+    DATABASE_URL = os.getenv("DATABASE_URL")
+    READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+
     POSTGRES_HOST = os.getenv("POSTGRES_HOST")
     POSTGRES_PORT = os.getenv("POSTGRES_PORT")
     POSTGRES_USER = os.getenv("POSTGRES_USER")
     POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
     POSTGRES_DB = os.getenv("POSTGRES_DB")
+    POSTGRES_REPLICA_HOST = os.getenv("POSTGRES_REPLICA_HOST")
+    POSTGRES_REPLICA_PORT = os.getenv("POSTGRES_REPLICA_PORT", POSTGRES_PORT)
+    READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 5))
 
     TOKEN = os.getenv("TOKEN")
     ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    DEFAULT_SHOP_NAME = os.getenv("DEFAULT_SHOP_NAME", "default")  # shop served by TOKEN
+    SHOPS_FILE = os.getenv("SHOPS_FILE")  # JSON list of {"name", "token", "admin_token"} for extra shops
+
+    # Cache sizes below are totals for the process, split evenly between shops
+
+    INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", 1024))
+    INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
+    RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 2048))
+    ORDER_VIEW_CACHE_SIZE = int(os.getenv("ORDER_VIEW_CACHE_SIZE", 5000))
+    ORDER_VIEW_TTL = float(os.getenv("ORDER_VIEW_TTL", 300))  # seconds before a rendered order is read again
+    CATALOG_TTL = float(os.getenv("CATALOG_TTL", 60))  # seconds before the cached catalog is reloaded
+
+    CART_WRITE_BEHIND = os.getenv("CART_WRITE_BEHIND", "false").lower() == "true"
+    CART_FLUSH_INTERVAL_MS = int(os.getenv("CART_FLUSH_INTERVAL_MS", 50))
+    CART_FLUSH_MAX_PENDING = int(os.getenv("CART_FLUSH_MAX_PENDING", 100))
+
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10_000))
+    WARM_UP_USERS = int(os.getenv("WARM_UP_USERS", 1000))
+    SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
+    POLLING_RETRY_DELAY = float(os.getenv("POLLING_RETRY_DELAY", 60))  # seconds before a failed shop polls again
+
+    PHOTOS_DIR = os.getenv("PHOTOS_DIR", "data/photos/processed")
+    PHOTOS_BASE_URL = os.getenv("PHOTOS_BASE_URL")  # public URL of the project root, used for inline thumbnails
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+    SENDER_RATE = float(os.getenv("SENDER_RATE", 25))  # messages per second, Telegram allows about 30
+    ABANDONED_CHECK_INTERVAL = float(os.getenv("ABANDONED_CHECK_INTERVAL", 600))
+    ABANDONED_CART_HOURS = float(os.getenv("ABANDONED_CART_HOURS", 24))
+    CART_RETENTION_DAYS = float(os.getenv("CART_RETENTION_DAYS", 30))
+    REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 100))
+    PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", 500))
+
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "false").lower() == "true"
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))  # share of updates traced when not TRACE_ENABLED
+    TRACE_FILE = os.getenv("TRACE_FILE", "traces.json")
+    LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+    LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 50))
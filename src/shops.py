@@ -0,0 +1,29 @@
+import json
+from dataclasses import dataclass
+
+from src.settings import Settings
+
+
+@dataclass(frozen=True, slots=True)
+class ShopConfig:
+    name: str
+    token: str
+    admin_token: str
+
+
+def load_shop_configs() -> list[ShopConfig]:
+    configs = []
+    if Settings.TOKEN:
+        configs.append(ShopConfig(Settings.DEFAULT_SHOP_NAME, Settings.TOKEN, Settings.ADMIN_TOKEN))
+    if Settings.SHOPS_FILE:
+        with open(Settings.BASE_DIR / Settings.SHOPS_FILE, "r", encoding="utf-8") as f:
+            configs.extend(ShopConfig(**shop) for shop in json.load(f))
+    names = [config.name for config in configs]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Shop names must be unique: {names}")
+    return configs
+
+
+def split_budget(total: int, shops_count: int) -> int:
+    # Global cache budget shared evenly, so adding shops does not grow the process memory
+    return max(1, total // shops_count)
@@ -0,0 +1,153 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, ParamSpec, TypeVar
+
+from src.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+T = TypeVar("T", bound=type)
+
+
+class Trace:
+    def __init__(self, tid: int) -> None:
+        self.tid = tid
+        self.events: list[dict] = []
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+class TraceExporter:
+    # Chrome trace event format, open the file in chrome://tracing or ui.perfetto.dev.
+    # The closing "]" is optional in that format, so events are simply appended.
+    def __init__(self, file_path: str) -> None:
+        self._file_path = file_path
+        self._lock = threading.Lock()
+
+    def write(self, events: list[dict]) -> None:
+        with self._lock:
+            new_file = not os.path.exists(self._file_path)
+            with open(self._file_path, "a", encoding="utf-8") as f:
+                if new_file:
+                    f.write("[\n")
+                for event in events:
+                    f.write(json.dumps(event, default=str) + ",\n")
+
+
+class Tracer:
+    def __init__(self, exporter: TraceExporter, sample_rate: float) -> None:
+        self._exporter = exporter
+        self.sample_rate = sample_rate
+        self._pid = os.getpid()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    @asynccontextmanager
+    async def trace(self, tid: int, name: str, category: str) -> AsyncIterator[None]:
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+        current = Trace(tid)
+        token = _current_trace.set(current)
+        try:
+            with self.span(name, category):
+                yield
+        finally:
+            _current_trace.reset(token)
+            await asyncio.to_thread(self._exporter.write, current.events)
+
+    @contextmanager
+    def span(self, name: str, category: str, **args: object) -> Iterator[None]:
+        current = _current_trace.get()
+        if current is None:
+            yield
+            return
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            current.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": started // 1000,
+                    "dur": (time.perf_counter_ns() - started) // 1000,
+                    "pid": self._pid,
+                    "tid": current.tid,
+                    "args": args,
+                }
+            )
+
+    def counter(self, name: str, **values: float) -> None:
+        event = {"name": name, "ph": "C", "ts": time.perf_counter_ns() // 1000, "pid": self._pid, "args": values}
+        self._exporter.write([event])
+
+    def trace_methods(self, category: str) -> Callable[[T], T]:
+        def decorator(cls: T) -> T:
+            if not self.enabled:  # no wrappers at all unless tracing is configured
+                return cls
+            for name, func in list(vars(cls).items()):
+                if not name.startswith("_") and inspect.iscoroutinefunction(func):
+                    setattr(cls, name, self._traced(func, f"{cls.__name__}.{name}", category))
+            return cls
+
+        return decorator
+
+    def _traced(self, func: Callable[P, Awaitable[R]], name: str, category: str) -> Callable[P, Awaitable[R]]:
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with self.span(name, category):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+
+class LoopLagMonitor:
+    def __init__(self, tracer: Tracer, interval: float, threshold: float) -> None:
+        self._tracer = tracer
+        self._interval = interval
+        self._threshold = threshold
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self._interval)
+            lag = time.perf_counter() - started - self._interval
+            if lag > self._threshold:
+                logger.warning(f"Event loop lag {lag * 1000:.1f} ms")
+                await asyncio.to_thread(self._tracer.counter, "event_loop_lag", ms=round(lag * 1000, 3))
+
+
+tracer = Tracer(
+    TraceExporter(Settings.TRACE_FILE),
+    1.0 if Settings.TRACE_ENABLED else Settings.TRACE_SAMPLE_RATE,
+)
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from src.db.cart_buffer import CartWriteBuffer
+from src.db.db_conf import DbSession
+from src.db.models import Category
+from src.db.repository import Repository
+
+MISSING_GOOD_ID = 10_000
+
+
+@pytest.fixture
+async def cart(repository: Repository, shop_id: int) -> tuple[int, list[int]]:
+    async with DbSession() as session:
+        category = Category(shop_id=shop_id, name="Coffee")
+        session.add(category)
+        await session.commit()
+    for name in ("good 0", "good 1"):
+        await repository.add_good({"name": name, "description": "", "price": "1.00", "category_id": category.id})
+    await repository.create_cart_user(1)
+    _, cart_id = await repository.get_user_cart_ids(1)
+    return cart_id, [row[2] for row in await repository.get_all_categories_goods()]
+
+
+async def cart_quantities(repository: Repository, cart_id: int) -> dict[int, int]:
+    return {row.id: row.quantity for row in await repository.get_cart_goods(cart_id)}
+
+
+async def test_flush_merges_adds(repository: Repository, cart: tuple[int, list[int]]) -> None:
+    cart_id, (first_id, second_id) = cart
+    buffer = CartWriteBuffer(repository, flush_interval=60, max_pending=100)
+
+    for good_id in (first_id, first_id, second_id):
+        await buffer.add(cart_id, good_id, chat_id=1)
+    assert buffer.pending_for_cart(cart_id) == {first_id: 2, second_id: 1}
+    await buffer.flush()
+
+    assert await cart_quantities(repository, cart_id) == {first_id: 2, second_id: 1}
+    assert buffer.pending_for_cart(cart_id) == {}
+
+
+async def test_in_flight_adds_stay_visible(
+    repository: Repository, cart: tuple[int, list[int]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cart_id, (first_id, _) = cart
+    buffer = CartWriteBuffer(repository, flush_interval=60, max_pending=100)
+    release = asyncio.Event()
+    add_goods_in_cart = repository.add_goods_in_cart
+
+    async def slow_add_goods_in_cart(deltas: dict[tuple[int, int], int], chat_ids: set[int] | None = None) -> None:
+        await release.wait()
+        await add_goods_in_cart(deltas, chat_ids)
+
+    monkeypatch.setattr(repository, "add_goods_in_cart", slow_add_goods_in_cart)
+    await buffer.add(cart_id, first_id)
+    flush = asyncio.create_task(buffer.flush())
+    await asyncio.sleep(0)
+    await buffer.add(cart_id, first_id)
+
+    assert buffer.pending_for_cart(cart_id) == {first_id: 2}
+    release.set()
+    await flush
+    assert buffer.pending_for_cart(cart_id) == {first_id: 1}
+    await buffer.flush()
+    assert await cart_quantities(repository, cart_id) == {first_id: 2}
+
+
+async def test_failed_flush_keeps_adds(
+    repository: Repository, cart: tuple[int, list[int]], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cart_id, (first_id, second_id) = cart
+    buffer = CartWriteBuffer(repository, flush_interval=60, max_pending=100)
+    await buffer.add(cart_id, first_id)
+    await buffer.add(cart_id, second_id)
+    add_goods_in_cart = repository.add_goods_in_cart
+
+    async def unavailable(deltas: dict[tuple[int, int], int], chat_ids: set[int] | None = None) -> None:
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(repository, "add_goods_in_cart", unavailable)
+    with pytest.raises(OperationalError):
+        await buffer.flush()
+    assert buffer.pending_for_cart(cart_id) == {first_id: 1, second_id: 1}
+
+    monkeypatch.setattr(repository, "add_goods_in_cart", add_goods_in_cart)
+    await buffer.flush()
+    assert await cart_quantities(repository, cart_id) == {first_id: 1, second_id: 1}
+
+
+async def test_failing_row_does_not_block_others(repository: Repository, cart: tuple[int, list[int]]) -> None:
+    cart_id, (first_id, second_id) = cart
+    buffer = CartWriteBuffer(repository, flush_interval=60, max_pending=100)
+    for good_id in (first_id, MISSING_GOOD_ID, second_id):
+        await buffer.add(cart_id, good_id)
+
+    await buffer.flush()
+
+    assert await cart_quantities(repository, cart_id) == {first_id: 1, second_id: 1}
+    assert buffer.pending_for_cart(cart_id) == {}
+
+
+async def test_close_flushes_pending_adds(repository: Repository, cart: tuple[int, list[int]]) -> None:
+    cart_id, (first_id, _) = cart
+    buffer = CartWriteBuffer(repository, flush_interval=60, max_pending=100)
+    buffer.start()
+    await buffer.add(cart_id, first_id)
+
+    await buffer.close()
+
+    assert await cart_quantities(repository, cart_id) == {first_id: 1}
@@ -0,0 +1,141 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from src.db.db_conf import DbSession
+from src.db.models import Category, DeliveryTypes
+from src.db.repository import Repository, ShopRepository
+from src.db.router import SessionRouter
+
+
+async def create_goods(repository: Repository, shop_id: int, prices: list[str]) -> list[int]:
+    async with DbSession() as session:
+        category = Category(shop_id=shop_id, name="Coffee")
+        session.add(category)
+        await session.commit()
+    for i, price in enumerate(prices):
+        await repository.add_good({"name": f"good {i}", "description": "", "price": price, "category_id": category.id})
+    rows = await repository.get_all_categories_goods()
+    return [row[2] for row in rows]
+
+
+async def create_user(repository: Repository, chat_id: int) -> tuple[int, int]:
+    await repository.create_cart_user(chat_id)
+    user_id, cart_id = await repository.get_user_cart_ids(chat_id)
+    return user_id, cart_id
+
+
+def in_a_day() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(days=1)
+
+
+async def test_add_goods_in_cart_upserts_quantities(repository: Repository, shop_id: int) -> None:
+    first_id, second_id = await create_goods(repository, shop_id, ["1.50", "2.00"])
+    _, cart_id = await create_user(repository, 1)
+
+    await repository.add_good_in_cart(cart_id, first_id)
+    await repository.add_good_in_cart(cart_id, first_id)
+    await repository.add_goods_in_cart({(cart_id, first_id): 2, (cart_id, second_id): 1})
+
+    rows = await repository.get_cart_goods(cart_id)
+    assert [(row.id, row.quantity) for row in rows] == [(first_id, 4), (second_id, 1)]
+
+
+async def test_foreign_keys_are_enforced(repository: Repository) -> None:
+    _, cart_id = await create_user(repository, 1)
+
+    with pytest.raises(IntegrityError):
+        await repository.add_goods_in_cart({(cart_id, 999_999): 1})
+
+
+async def test_create_order_copies_items_and_updates_sales(repository: Repository, shop_id: int) -> None:
+    first_id, second_id = await create_goods(repository, shop_id, ["1.50", "2.00"])
+    user_id, cart_id = await create_user(repository, 1)
+    await repository.add_goods_in_cart({(cart_id, first_id): 2, (cart_id, second_id): 1})
+
+    order = await repository.create_order(user_id, cart_id, DeliveryTypes.PICKUP)
+
+    assert await repository.get_cart_goods(cart_id) == []
+    items = await repository.get_orders_goods([order.id])
+    assert [(row.quantity, row.price) for row in items] == [(2, Decimal("1.50")), (1, Decimal("2.00"))]
+    since = date.today() - timedelta(days=1)
+    [daily] = await repository.get_daily_sales(since)
+    assert (daily.orders_count, daily.items_count, daily.revenue) == (1, 3, Decimal("5.00"))
+    top = await repository.get_top_goods(since, 1)
+    assert [(row[1], row[2]) for row in top] == [(2, Decimal("3.00"))]
+
+
+async def test_create_order_with_empty_cart_skips_sales(repository: Repository) -> None:
+    user_id, cart_id = await create_user(repository, 1)
+
+    await repository.create_order(user_id, cart_id, DeliveryTypes.PICKUP)
+
+    assert await repository.get_daily_sales(date.today() - timedelta(days=1)) == []
+
+
+async def test_purge_expired_carts_in_chunks(repository: Repository, shop_id: int) -> None:
+    [good_id] = await create_goods(repository, shop_id, ["1.00"])
+    cart_ids = [(await create_user(repository, chat_id))[1] for chat_id in (1, 2, 3)]
+    await repository.add_goods_in_cart({(cart_id, good_id): 1 for cart_id in cart_ids})
+
+    assert await repository.purge_expired_carts(datetime.now(timezone.utc) - timedelta(days=1), 1) == 0
+    assert await repository.purge_expired_carts(in_a_day(), 1) == 3
+    for cart_id in cart_ids:
+        assert await repository.get_cart_goods(cart_id) == []
+
+
+async def test_pop_abandoned_carts_returns_each_cart_once(repository: Repository, shop_id: int) -> None:
+    [good_id] = await create_goods(repository, shop_id, ["1.00"])
+    _, cart_id = await create_user(repository, 1)
+    await create_user(repository, 2)  # empty cart, nothing to remind about
+    await repository.add_good_in_cart(cart_id, good_id)
+
+    assert await repository.pop_abandoned_carts(in_a_day(), 10) == [1]
+    assert await repository.pop_abandoned_carts(in_a_day(), 10) == []
+
+
+async def test_change_order_status_returning(router: SessionRouter, repository: Repository) -> None:
+    user_id, cart_id = await create_user(repository, 1)
+    order = await repository.create_order(user_id, cart_id, DeliveryTypes.PICKUP)
+    other_shop_id = await ShopRepository(router).get_or_create_shop_id("other")
+
+    await repository.change_order_status(order.id, "Delivered")
+
+    [row] = await repository.show_orders()
+    assert row.status == "Delivered"
+    with pytest.raises(ValueError):
+        await repository.change_order_status(order.id + 1, "Delivered")
+    with pytest.raises(ValueError):
+        await Repository(router, other_shop_id).change_order_status(order.id, "Stolen")
+
+
+async def test_update_good_photo_returning(repository: Repository, shop_id: int) -> None:
+    [good_id] = await create_goods(repository, shop_id, ["1.00"])
+
+    assert await repository.update_good_photo("good 0", {"photo_file_id": "file"}) == good_id
+    with pytest.raises(ValueError):
+        await repository.update_good_photo("missing", {"photo_file_id": "file"})
+
+
+async def test_user_orders_keyset_pages(repository: Repository) -> None:
+    user_id, cart_id = await create_user(repository, 1)
+    order_ids = [(await repository.create_order(user_id, cart_id, DeliveryTypes.PICKUP)).id for _ in range(3)]
+
+    first_page = await repository.get_user_orders(user_id, None, 2)
+    second_page = await repository.get_user_orders(user_id, first_page[-1].id, 2)
+
+    assert [row.id for row in first_page + second_page] == order_ids[::-1]
+
+
+async def test_same_chat_in_two_shops(router: SessionRouter, repository: Repository) -> None:
+    other_shop_id = await ShopRepository(router).get_or_create_shop_id("other")
+    other_repository = Repository(router, other_shop_id)
+
+    _, cart_id = await create_user(repository, 1)
+    _, other_cart_id = await create_user(other_repository, 1)
+
+    assert cart_id != other_cart_id
+    with pytest.raises(IntegrityError):
+        await repository.create_cart_user(1)
@@ -0,0 +1,70 @@
+import asyncio
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from src.bot.exceptions import UserDoesNotExist
+from src.db.db_conf import DbSession, engine
+from src.db.models import Base, Category
+from src.db.repository import Repository
+from src.db.router import SessionRouter, current_chat_id
+
+WINDOW = 0.2
+
+
+@pytest.fixture
+async def replica_engine(tmp_path: Path) -> AsyncIterator[AsyncEngine]:
+    # A second file that is never written to, like a replica that has not caught up yet
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    async with replica.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield replica
+    await replica.dispose()
+
+
+@pytest.fixture
+def split_router(router: SessionRouter, replica_engine: AsyncEngine) -> SessionRouter:
+    return SessionRouter(DbSession, async_sessionmaker(replica_engine, expire_on_commit=False), WINDOW)
+
+
+async def test_reads_go_to_replica(split_router: SessionRouter, replica_engine: AsyncEngine, shop_id: int) -> None:
+    repository = Repository(split_router, shop_id)
+    async with DbSession() as session:
+        category = Category(shop_id=shop_id, name="Coffee")
+        session.add(category)
+        await session.commit()
+    await repository.add_good({"name": "good", "description": "", "price": "1.00", "category_id": category.id})
+
+    assert split_router.reader().bind is replica_engine
+    assert await repository.get_all_categories_goods() == []
+    assert len(await repository.get_all_categories_goods(primary=True)) == 1
+
+
+async def test_writer_switches_chat_to_primary(split_router: SessionRouter, shop_id: int) -> None:
+    repository = Repository(split_router, shop_id)
+    token = current_chat_id.set(1)
+    try:
+        await repository.create_cart_user(1)
+
+        assert split_router.reader().bind is engine
+        await repository.get_user_cart_ids(1)
+
+        await asyncio.sleep(WINDOW)
+        assert split_router.reader().bind is not engine
+        with pytest.raises(UserDoesNotExist):
+            await repository.get_user_cart_ids(1)
+    finally:
+        current_chat_id.reset(token)
+
+
+async def test_mark_writes_switches_only_marked_chats(split_router: SessionRouter) -> None:
+    split_router.mark_writes({1})
+
+    for chat_id, reads_primary in ((1, True), (2, False), (None, False)):
+        token = current_chat_id.set(chat_id)
+        try:
+            assert (split_router.reader().bind is engine) is reads_primary
+        finally:
+            current_chat_id.reset(token)